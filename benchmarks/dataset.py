@@ -0,0 +1,179 @@
+'''
+Synthetic dataset generator: materials with the same kind of formulas and
+properties as data.csv, in any number, written in the csv upload format
+
+The distributions are learned from a sample file (data.csv by default):
+number of elements per compound, element frequencies (smoothed over the
+stable, non-noble elements so that the whole periodic table shows up),
+stoichiometric coefficients, and, for each property name, how often it is
+present and the values it takes. Numerical values are resampled with a small
+log-normal jitter, text values are drawn from the sample.
+
+Usage
+-----
+$ python -m benchmarks.dataset --materials 1000000 --seed 0 --output materials.csv
+'''
+import argparse
+import bisect
+import csv
+import itertools
+import math
+import os
+import random
+import re
+import sys
+from collections import Counter, OrderedDict
+
+from data import periodic_table
+from data.tools import valid_float
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PATH = os.path.join(BASE_DIR, 'data.csv')
+
+FORMULA = re.compile(r'([A-Z][a-z]?)(\d*)')
+
+# Elements up to Bi (83) are drawn even if they do not occur in the sample;
+# noble gases and Tc (no stable isotopes) are left out
+SMOOTHED_ELEMENTS = [symbol for symbol in periodic_table.SYMBOLS[:83]
+                     if symbol not in ('He', 'Ne', 'Ar', 'Kr', 'Xe', 'Tc')]
+SMOOTHING_WEIGHT = 0.1
+
+# The sample has almost only binary compounds; real databases have a tail of
+# ternary and quaternary ones (weights relative to the sample counts)
+EXTRA_ELEMENT_COUNTS = {3: 0.15, 4: 0.05}
+
+# Relative width of the log-normal jitter of numerical property values
+VALUE_JITTER = 0.1
+
+
+class WeightedChoice:
+    '''
+    Draw items with given weights (bisection over the cumulative weights)
+    '''
+    def __init__(self, weights):
+        self.items = list(weights)
+        self.cumulative = list(itertools.accumulate(weights[item] for item in self.items))
+
+    def __call__(self, rng):
+        return self.items[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+class MaterialGenerator:
+    '''
+    Generator of random materials resembling the ones in a sample csv file
+
+    Parameters
+    ----------
+    sample_path : string, optional
+                    Path to the csv file in the upload format (data.csv by default)
+    seed : int, optional
+                    Seed of the random number generator; equal seeds give equal datasets
+    '''
+    def __init__(self, sample_path=SAMPLE_PATH, seed=0):
+        self.rng = random.Random(seed)
+        with open(sample_path) as f:
+            rows = [row for row in csv.reader(f) if row][1:]
+
+        n_elements = Counter()
+        elements = Counter()
+        coefficients = Counter()
+        self.properties = OrderedDict()
+        for row in rows:
+            composition = FORMULA.findall(row[0])
+            n_elements[len(composition)] += 1
+            for symbol, coefficient in composition:
+                elements[symbol] += 1
+                coefficients[int(coefficient or 1)] += 1
+            for i in range(1, len(row) - 1, 2):
+                self.properties.setdefault(row[i], []).append(row[i+1])
+
+        total = sum(n_elements.values())
+        for count, weight in EXTRA_ELEMENT_COUNTS.items():
+            n_elements[count] += weight * total
+        for symbol in SMOOTHED_ELEMENTS:
+            elements[symbol] += SMOOTHING_WEIGHT
+
+        self.choose_n_elements = WeightedChoice(n_elements)
+        self.choose_element = WeightedChoice(elements)
+        self.choose_coefficient = WeightedChoice(coefficients)
+        # Frequency of each property, and whether all its values are numbers
+        self.frequency = {name: len(values) / len(rows) for name, values in self.properties.items()}
+        self.numerical = {name: all(valid_float(value) for value in values)
+                          for name, values in self.properties.items()}
+
+    def formula(self):
+        '''
+        Random chemical formula in the format of data.csv, e.g. "Ga2Se3"
+        '''
+        n_elements = self.choose_n_elements(self.rng)
+        symbols = []
+        while len(symbols) < n_elements:
+            symbol = self.choose_element(self.rng)
+            if symbol not in symbols:
+                symbols.append(symbol)
+        if n_elements == 1:
+            return symbols[0]
+        return "".join("{}{}".format(symbol, self.choose_coefficient(self.rng)) for symbol in symbols)
+
+    def value(self, name):
+        '''
+        Random value of the property with a given name
+        '''
+        value = self.rng.choice(self.properties[name])
+        if not self.numerical[name]:
+            return value
+        jitter = math.exp(self.rng.gauss(0, VALUE_JITTER))
+        return "{:.3g}".format(float(value) * jitter)
+
+    def material(self):
+        '''
+        Random material as a list: formula, followed by property name/value pairs
+        '''
+        row = [self.formula()]
+        for name, frequency in self.frequency.items():
+            if self.rng.random() < frequency:
+                row.extend((name, self.value(name)))
+        return row
+
+    def materials(self, n_materials):
+        '''
+        Iterator over n_materials random materials; uses constant memory
+        '''
+        for _ in range(n_materials):
+            yield self.material()
+
+
+def write_csv(f, rows):
+    '''
+    Write materials to a text file in the csv upload format (see db.db_from_csv)
+
+    Parameters
+    ----------
+    f : file object, required
+    rows : iterable, required
+            Materials as returned by MaterialGenerator.materials
+    '''
+    f.write("Chemical formula,Property 1 name,Property 1 value,Property 2 name,Property 2 value\n")
+    for row in rows:
+        f.write(",".join(row) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--materials', type=int, default=10000, help='Number of materials to generate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random number generator')
+    parser.add_argument('--sample', default=SAMPLE_PATH, help='csv file to learn the distributions from')
+    parser.add_argument('--output', help='Output csv file (standard output by default)')
+    args = parser.parse_args()
+
+    generator = MaterialGenerator(args.sample, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_csv(f, generator.materials(args.materials))
+    else:
+        write_csv(sys.stdout, generator.materials(args.materials))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+'''
+Encoding benchmark: time to encode a search result and its size on the wire
+
+Compares the current response path (JsonResponse with the json module) against
+FastJsonResponse (orjson, if installed), and the size of the body without
+compression, with gzip and with brotli (if installed)
+
+Usage
+-----
+$ python -m benchmarks.encoding --materials 100000 --repeat 5
+'''
+import argparse
+import csv
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from django.http import JsonResponse
+from django.utils.text import compress_string
+
+from data import responses
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def search_result(n_materials):
+    '''
+    Search result shaped like the output of db.query_to_dictionary,
+    made by repeating the materials from data.csv
+
+    Parameters
+    ----------
+    n_materials : int, required
+                    Number of materials in the result
+
+    Returns
+    -------
+    list
+            List of dictionaries, one per material
+    '''
+    with open(os.path.join(BASE_DIR, 'data.csv')) as f:
+        rows = [row for row in csv.reader(f)][1:]
+    result = []
+    for n in range(n_materials):
+        row = rows[n % len(rows)]
+        result.append({
+            'compound': row[0],
+            'properties': [{'propertyName': row[i], 'propertyValue': row[i+1]} for i in range(1, len(row) - 1, 2)],
+        })
+    return result
+
+
+def timed(function, repeat):
+    '''
+    Call function repeat times; return the median time in seconds and the last result
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--materials', type=int, default=100000, help='Number of materials in the search result')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions of each measurement')
+    args = parser.parse_args()
+
+    data = search_result(args.materials)
+    stdlib_seconds, stdlib_response = timed(lambda: JsonResponse(data, safe=False), args.repeat)
+    fast_seconds, fast_response = timed(lambda: responses.FastJsonResponse(data, safe=False), args.repeat)
+    body = fast_response.content
+    gzip_seconds, gzip_body = timed(lambda: compress_string(body), args.repeat)
+
+    result = {
+        'benchmark': 'encoding',
+        'materials': args.materials,
+        'encoder': 'orjson' if responses.orjson is not None else 'json',
+        'encode_seconds': {'JsonResponse': stdlib_seconds, 'FastJsonResponse': fast_seconds},
+        'bytes': {'JsonResponse': len(stdlib_response.content), 'FastJsonResponse': len(body), 'gzip': len(gzip_body)},
+        'compress_seconds': {'gzip': gzip_seconds},
+    }
+    if responses.brotli is not None:
+        brotli_seconds, brotli_body = timed(
+            lambda: responses.brotli.compress(body, quality=responses.BROTLI_QUALITY), args.repeat)
+        result['bytes']['brotli'] = len(brotli_body)
+        result['compress_seconds']['brotli'] = brotli_seconds
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
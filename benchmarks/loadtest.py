@@ -0,0 +1,217 @@
+'''
+Load test: replay recorded requests against a running instance of the app
+
+Requests are read from a json lines file written by data.recorder.TrafficRecorderMiddleware
+(set TRAFFIC_RECORD_PATH to record them). They are sent in the recorded order,
+starting over when the file is exhausted, by a pool of concurrent clients.
+Without --rate, each client sends its next request as soon as it gets a
+response (closed loop); with --rate, requests arrive at the given average rate
+whatever the response times are (open loop), with constant or Poisson
+(exponentially distributed) intervals.
+
+Recorded /data/add requests write to the database: replay them against a test instance.
+
+Usage
+-----
+$ python -m benchmarks.loadtest traffic.jsonl --url http://127.0.0.1:8000 \\
+      --concurrency 16 --rate 50 --duration 60 --label "gunicorn -w 4" --output results.json
+'''
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def endpoint(record):
+    '''
+    Name of the endpoint of a recorded request (last part of its path), for the report
+    '''
+    return record['path'].rstrip('/').rsplit('/', 1)[-1] or 'index'
+
+
+def percentile(values, q):
+    '''
+    q-th percentile of a list of numbers (nearest-rank method); None for an empty list
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(round(q / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+def read_records(path, endpoints=None):
+    '''
+    Recorded requests, optionally only those to the given endpoints (e.g. "search")
+    '''
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if endpoints:
+        records = [record for record in records if endpoint(record) in endpoints]
+    if not records:
+        raise SystemExit('No requests to replay in {}'.format(path))
+    return records
+
+
+class Replayer:
+    '''
+    Send recorded requests to the app and collect the outcomes
+
+    Parameters
+    ----------
+    url : string, required
+            Base url of the app, e.g. http://127.0.0.1:8000
+    timeout : float, required
+            Timeout of a single request, in seconds
+    '''
+    def __init__(self, url, timeout):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # endpoint -> list of (latency in seconds, status code or None for errors, response size)
+        self.outcomes = defaultdict(list)
+        self.lags = []
+
+    def session(self):
+        # One keep-alive session per client thread
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def send(self, record, scheduled=None):
+        start = time.perf_counter()
+        url = self.url + record['path']
+        if record.get('query_string'):
+            url += '?' + record['query_string']
+        try:
+            response = self.session().request(
+                record['method'], url, data=record['body'].encode('utf-8'),
+                headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+            outcome = (time.perf_counter() - start, response.status_code, len(response.content))
+        except requests.RequestException:
+            outcome = (time.perf_counter() - start, None, 0)
+        with self.lock:
+            self.outcomes[endpoint(record)].append(outcome)
+            if scheduled is not None:
+                # How late the request was sent; large lags mean that the load generator,
+                # not the app, is the bottleneck (increase --concurrency)
+                self.lags.append(start - scheduled)
+
+    def report(self, seconds):
+        '''
+        Latency percentiles, throughput and error rates, in total and per endpoint
+        '''
+        def summary(outcomes):
+            latencies = [latency for latency, status, size in outcomes if status is not None]
+            errors = [status for latency, status, size in outcomes if status is None or status >= 400]
+            return {
+                'requests': len(outcomes),
+                'throughput': len(outcomes) / seconds,
+                'error_rate': len(errors) / len(outcomes) if outcomes else None,
+                'connection_errors': sum(1 for status in errors if status is None),
+                'p50_seconds': percentile(latencies, 50),
+                'p95_seconds': percentile(latencies, 95),
+                'p99_seconds': percentile(latencies, 99),
+                'max_seconds': max(latencies) if latencies else None,
+                'mean_bytes': sum(size for latency, status, size in outcomes) / len(outcomes) if outcomes else None,
+            }
+
+        all_outcomes = list(itertools.chain.from_iterable(self.outcomes.values()))
+        report = summary(all_outcomes)
+        report['endpoints'] = {name: summary(outcomes) for name, outcomes in sorted(self.outcomes.items())}
+        if self.lags:
+            report['p99_send_lag_seconds'] = percentile(self.lags, 99)
+        return report
+
+
+def run_closed(replayer, records, concurrency, deadline, n_requests):
+    '''
+    Each of the concurrency clients sends requests back to back
+    '''
+    counter = itertools.count()
+
+    def client():
+        while time.perf_counter() < deadline:
+            n = next(counter)
+            if n_requests and n >= n_requests:
+                return
+            replayer.send(records[n % len(records)])
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open(replayer, records, concurrency, deadline, n_requests, rate, arrival, rng):
+    '''
+    Requests arrive at the given average rate; at most concurrency of them are in flight
+    '''
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        scheduled = time.perf_counter()
+        for n in itertools.count():
+            if (n_requests and n >= n_requests) or scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(replayer.send, records[n % len(records)], scheduled)
+            interval = rng.expovariate(rate) if arrival == 'poisson' else 1 / rate
+            scheduled += interval
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('records', help='json lines file with the recorded requests')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base url of the app')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--rate', type=float, help='Average arrival rate, requests per second (open loop)')
+    parser.add_argument('--arrival', choices=('constant', 'poisson'), default='poisson',
+                        help='Distribution of the intervals between requests, with --rate')
+    parser.add_argument('--duration', type=float, default=30, help='Duration of the test, in seconds')
+    parser.add_argument('--requests', type=int, help='Stop after this number of requests')
+    parser.add_argument('--endpoints', nargs='*', help='Replay only requests to these endpoints (add, search, facets)')
+    parser.add_argument('--timeout', type=float, default=60, help='Timeout of a request, in seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the Poisson arrivals')
+    parser.add_argument('--label', help='Label of the run in the report (e.g. the server configuration)')
+    parser.add_argument('--output', help='Write the report to this json file')
+    args = parser.parse_args()
+
+    records = read_records(args.records, args.endpoints)
+    replayer = Replayer(args.url, args.timeout)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    if args.rate:
+        run_open(replayer, records, args.concurrency, deadline, args.requests,
+                 args.rate, args.arrival, random.Random(args.seed))
+    else:
+        run_closed(replayer, records, args.concurrency, deadline, args.requests)
+    seconds = time.perf_counter() - start
+
+    report = {
+        'benchmark': 'loadtest',
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'arrival': args.arrival if args.rate else 'closed',
+        'seconds': seconds,
+    }
+    report.update(replayer.report(seconds))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+In-memory stand-in for the Elasticsearch backend, so that searches can be benchmarked offline
+
+Documents are prepared by MaterialIndex, as for Elasticsearch, and kept in an
+inverted index in the memory of the process. The query parser understands the
+subset of the Lucene syntax used by the search queries of the benchmarks:
+terms (optionally prefixed by a field name, e.g. element:Pb), groups of terms
+(element:(Pb AND Se)), the AND keyword and the match-all queries *, *:* and the
+empty query. All terms
+must match (AND semantics); matching is case-insensitive.
+'''
+import re
+from collections import defaultdict
+
+from haystack.backends import BaseEngine, BaseSearchBackend, log_query
+from haystack.backends.simple_backend import SimpleSearchQuery
+from haystack.models import SearchResult
+
+
+GROUP = re.compile(r'(\w+):\(([^)]*)\)')
+TERM = re.compile(r'(?:(\w+):)?(\S+)')
+
+
+class MemorySearchBackend(BaseSearchBackend):
+    # The index is shared by all backend instances of the process
+    postings = defaultdict(set)
+    documents = {}
+
+    def update(self, index, iterable, commit=True):
+        model = index.get_model()
+        for obj in iterable:
+            self.remove(obj)
+            prepared = index.full_prepare(obj)
+            terms = set()
+            for field, value in prepared.items():
+                if field == 'text':
+                    field = None
+                for token in str(value).lower().split():
+                    terms.add((field, token))
+            for term in terms:
+                self.postings[term].add(obj.pk)
+            self.documents[obj.pk] = (model, terms)
+
+    def remove(self, obj_or_string, commit=True):
+        pk = getattr(obj_or_string, 'pk', None)
+        if pk is None:
+            pk = int(str(obj_or_string).split('.')[-1])
+        _, terms = self.documents.pop(pk, (None, ()))
+        for term in terms:
+            self.postings[term].discard(pk)
+
+    def remove_many(self, obj_or_strings, commit=True):
+        for obj_or_string in obj_or_strings:
+            self.remove(obj_or_string, commit=commit)
+
+    def clear(self, models=None, commit=True):
+        self.postings.clear()
+        self.documents.clear()
+
+    def parse(self, query_string):
+        '''
+        Split the query into (field, term) pairs; field is None for the default text field
+        '''
+        query_string = GROUP.sub(lambda match: ' '.join(
+            '{}:{}'.format(match.group(1), term) for term in match.group(2).split() if term != 'AND'), query_string)
+        return [(field or None, term.lower()) for field, term in TERM.findall(query_string) if term != 'AND']
+
+    @log_query
+    def search(self, query_string, **kwargs):
+        # An empty query matches everything, as it does in Elasticsearch (haystack sends it as *:*)
+        if query_string.strip() in ('', '*', '*:*'):
+            pks = set(self.documents)
+        else:
+            terms = self.parse(query_string)
+            pks = set.intersection(*[self.postings.get(term, set()) for term in terms]) if terms else set()
+        results = []
+        for pk in sorted(pks):
+            model = self.documents[pk][0]
+            results.append(SearchResult(model._meta.app_label, model._meta.model_name, pk, 1.0))
+        return {
+            'results': results,
+            'hits': len(results),
+        }
+
+
+class MemoryEngine(BaseEngine):
+    backend = MemorySearchBackend
+    query = SimpleSearchQuery
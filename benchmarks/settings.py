@@ -0,0 +1,29 @@
+'''
+Settings for the benchmarks: the application settings with a local database
+and the in-memory search backend instead of Elasticsearch
+
+The database is taken from BENCHMARK_DATABASE_URL (a local sqlite3 file by default);
+the benchmarks run in a test database created next to it, which is destroyed afterwards
+'''
+import os
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.sqlite3')
+
+from materials_db.settings import *  # noqa: F401,F403
+import dj_database_url
+
+DATABASES = {
+    'default': dj_database_url.parse(os.environ.get('BENCHMARK_DATABASE_URL', os.environ['DATABASE_URL'])),
+}
+DATABASE_REPLICAS = []
+
+HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'benchmarks.search_backend.MemoryEngine',
+    },
+}
+
+# Benchmarks count SQL queries
+DEBUG = False
@@ -0,0 +1,81 @@
+'''
+Startup benchmark: time to boot the WSGI application and the memory it takes
+
+Every run starts a fresh interpreter that does what a gunicorn worker does on boot:
+import materials_db.wsgi (which sets Django up and imports all models and admin modules)
+and load the URL configuration (which imports the views)
+
+Usage
+-----
+$ python -m benchmarks.startup --repeat 10 --output startup.jsonl
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER_BOOT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import materials_db.wsgi
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "pyEQL_loaded": "pyEQL" in sys.modules,
+}))
+'''
+
+
+def boot_worker():
+    '''
+    Boot the application in a new interpreter
+
+    Returns
+    -------
+    dict
+            Boot time in seconds, peak RSS in Mb, number of imported modules,
+            and whether pyEQL has been imported
+    '''
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'materials_db.settings')
+    output = subprocess.check_output([sys.executable, '-c', WORKER_BOOT], cwd=BASE_DIR, env=env)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5, help='Number of interpreters to boot')
+    parser.add_argument('--output', help='Append the result as a json line to this file')
+    args = parser.parse_args()
+
+    runs = [boot_worker() for _ in range(args.repeat)]
+    seconds = [run['seconds'] for run in runs]
+    rss = [run['max_rss_mb'] for run in runs]
+    result = {
+        'benchmark': 'startup',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'seconds_median': statistics.median(seconds),
+        'seconds_min': min(seconds),
+        'max_rss_mb_median': statistics.median(rss),
+        'modules': runs[-1]['modules'],
+        'pyEQL_loaded': runs[-1]['pyEQL_loaded'],
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
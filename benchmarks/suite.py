@@ -0,0 +1,276 @@
+'''
+Benchmark suite: ingest throughput, search latency, SQL query counts and memory peaks
+
+The suite creates a throwaway test database, fills it with synthetic materials
+(benchmarks.dataset) through db.db_from_csv and the /data/add API, indexes them
+in the in-memory search backend (benchmarks.search_backend), and runs searches
+of several shapes through the /data/search API. Runs with the same arguments
+use the same data and the same queries.
+
+Usage
+-----
+$ python -m benchmarks.suite --materials 10000 --searches 100 --output results.json
+
+Large datasets (10^6 materials and more) should use a PostgreSQL database, given
+in the dj_database_url format by the BENCHMARK_DATABASE_URL environment variable
+'''
+import argparse
+import io
+import json
+import os
+import random
+import time
+import tracemalloc
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+django.setup()
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from haystack import connections as haystack_connections
+
+from benchmarks.dataset import MaterialGenerator, write_csv
+from data import db
+from data.models import Material
+
+
+# Number of materials per uploaded csv file; db_from_csv accepts files of up to 2.5 Mb
+UPLOAD_MATERIALS = 20000
+# Number of materials per /data/add request
+ADD_MATERIALS = 100
+
+
+def percentile(values, q):
+    '''
+    q-th percentile of a list of numbers (nearest-rank method)
+    '''
+    values = sorted(values)
+    rank = max(1, int(round(q / 100 * len(values) + 0.5)))
+    return values[min(rank, len(values)) - 1]
+
+
+class QueryCounter:
+    '''
+    Database execute wrapper counting SQL queries; unlike CaptureQueriesContext,
+    it is not reset by the request_started signal of the test client
+    '''
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(function):
+    '''
+    Call function, counting the SQL queries it makes
+
+    Returns
+    -------
+    (float, int, object)
+            Time in seconds, number of SQL queries, and the return value of function
+    '''
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+    return seconds, counter.count, result
+
+
+def memory_peak(function):
+    '''
+    Peak memory in Mb allocated by Python while function is called (tracemalloc);
+    measured separately from time, since tracing slows the code down
+    '''
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def benchmark_upload(generator, n_materials):
+    '''
+    Add n_materials to the database through db.db_from_csv, in files of UPLOAD_MATERIALS materials
+    '''
+    seconds = 0
+    queries = 0
+    peak = 0
+    for start in range(0, n_materials, UPLOAD_MATERIALS):
+        f = io.StringIO()
+        write_csv(f, generator.materials(min(UPLOAD_MATERIALS, n_materials - start)))
+        content = f.getvalue().encode('utf-8')
+        upload = SimpleUploadedFile('materials.csv', content)
+        if start == 0:
+            peak = memory_peak(lambda: db.db_from_csv(SimpleUploadedFile('materials.csv', content)))
+            Material.objects.all().delete()
+        chunk_seconds, chunk_queries, _ = measure(lambda: db.db_from_csv(upload))
+        seconds += chunk_seconds
+        queries += chunk_queries
+    return {
+        'materials': n_materials,
+        'materials_per_second': n_materials / seconds,
+        'queries_per_material': queries / n_materials,
+        'memory_peak_mb': peak,
+    }
+
+
+def benchmark_add(generator, n_materials):
+    '''
+    Add n_materials to the database through the /data/add API, ADD_MATERIALS per request
+    '''
+    client = Client()
+    latencies = []
+    queries = 0
+    for start in range(0, n_materials, ADD_MATERIALS):
+        body = json.dumps([{
+            'compound': row[0],
+            'properties': [{'propertyName': row[i], 'propertyValue': row[i+1]} for i in range(1, len(row) - 1, 2)],
+        } for row in generator.materials(min(ADD_MATERIALS, n_materials - start)) if len(row) > 1])
+        request_seconds, request_queries, response = measure(
+            lambda: client.post('/data/add', data=body, content_type='application/json'))
+        if response.status_code != 200:
+            raise RuntimeError('/data/add failed: {}'.format(response.content))
+        latencies.append(request_seconds)
+        queries += request_queries
+    return {
+        'materials': n_materials,
+        'materials_per_second': n_materials / sum(latencies),
+        'queries_per_material': queries / n_materials,
+        'request_p50_seconds': percentile(latencies, 50),
+        'request_p99_seconds': percentile(latencies, 99),
+    }
+
+
+def benchmark_index():
+    '''
+    Index all materials in the in-memory search backend
+    '''
+    index = haystack_connections['default'].get_unified_index().get_index(Material)
+    backend = haystack_connections['default'].get_backend()
+    backend.clear()
+    seconds, queries, _ = measure(lambda: backend.update(index, index.index_queryset().iterator()))
+    return {'seconds': seconds, 'queries': queries}
+
+
+def search_shapes(generator, rng):
+    '''
+    Functions returning random search queries, by query shape
+    '''
+    colors = generator.properties['Color']
+    compounds = list(Material.objects.values_list('compound', flat=True)[:1000])
+
+    def float_property():
+        return {'name': 'gap', 'value': '{:.2f}'.format(rng.uniform(0.5, 4)), 'logic': rng.choice(['>', '<'])}
+
+    return {
+        'compound': lambda: {'search': 'compound:{}'.format(rng.choice(compounds))},
+        'element_pair': lambda: {'search': 'element:({} AND {})'.format(
+            generator.choose_element(rng), generator.choose_element(rng))},
+        'group_pair': lambda: {'search': 'group:({} AND {})'.format(rng.randint(13, 15), rng.randint(15, 17))},
+        'property_float': lambda: {'properties': [float_property()]},
+        'property_text': lambda: {'properties': [{'name': 'color', 'value': rng.choice(colors).split()[-1],
+                                                  'logic': 'icontains'}]},
+        'element_and_property': lambda: {'search': 'element:{}'.format(generator.choose_element(rng)),
+                                         'properties': [float_property()]},
+    }
+
+
+def benchmark_search(generator, n_searches, seed):
+    '''
+    Run n_searches queries of each shape through the /data/search API
+
+    Searches matching more than SEARCH_MAX_RESULTS materials are answered with 413,
+    as on a production server: they are counted as rejected, and their latency is
+    included in the percentiles
+    '''
+    rng = random.Random(seed)
+    client = Client()
+    results = {}
+    for shape, make_query in search_shapes(generator, rng).items():
+        latencies = []
+        queries = []
+        sizes = []
+        rejected = 0
+        for _ in range(n_searches):
+            body = json.dumps(make_query())
+            seconds, n_queries, response = measure(
+                lambda: client.post('/data/search', data=body, content_type='application/json'))
+            if response.status_code == 413:
+                rejected += 1
+            elif response.status_code != 200:
+                raise RuntimeError('/data/search failed: {}'.format(response.content))
+            latencies.append(seconds)
+            queries.append(n_queries)
+            sizes.append(len(response.content))
+        results[shape] = {
+            'p50_seconds': percentile(latencies, 50),
+            'p95_seconds': percentile(latencies, 95),
+            'p99_seconds': percentile(latencies, 99),
+            'mean_queries': sum(queries) / n_searches,
+            'mean_bytes': sum(sizes) / n_searches,
+            'rejected': rejected,
+            'memory_peak_mb': memory_peak(
+                lambda: client.post('/data/search', data=body, content_type='application/json')),
+        }
+    return results
+
+
+def benchmark_serialize(n_materials):
+    '''
+    Serialize n_materials materials with db.query_to_dictionary
+    '''
+    query = Material.objects.order_by('pk')[:n_materials]
+    seconds, queries, result = measure(lambda: db.query_to_dictionary(query))
+    return {
+        'materials': len(result),
+        'materials_per_second': len(result) / seconds if seconds else None,
+        'queries': queries,
+        'memory_peak_mb': memory_peak(lambda: db.query_to_dictionary(query)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--materials', type=int, default=10000, help='Number of materials added with db_from_csv')
+    parser.add_argument('--add-materials', type=int, default=1000,
+                        help='Number of materials added through the /data/add API')
+    parser.add_argument('--searches', type=int, default=50, help='Number of searches of each shape')
+    parser.add_argument('--serialize', type=int, default=1000, help='Number of materials to serialize')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset and query generators')
+    parser.add_argument('--output', help='Write the results to this json file')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        generator = MaterialGenerator(seed=args.seed)
+        result = {
+            'benchmark': 'suite',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'database': connection.vendor,
+            'seed': args.seed,
+            'upload': benchmark_upload(generator, args.materials),
+            'add': benchmark_add(generator, args.add_materials),
+            'index': benchmark_index(),
+        }
+        result['search'] = benchmark_search(generator, args.searches, args.seed)
+        result['serialize'] = benchmark_serialize(args.serialize)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,289 @@
-from django.contrib import admin
-from .models import Material, Property
+import json
+from collections import Counter
 
-# Register your models here.
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+from haystack import connections as haystack_connections
 
-admin.site.register(Material)
-admin.site.register(Property)
+from .models import Material, Property, FacetCount, Generation, Change
+from .responses import CompressionMiddleware
+from .routers import PIN_COOKIE, replica_reads
+
+
+# Number of objects deleted, exported or reindexed at a time by the bulk actions
+ADMIN_BATCH_SIZE = 1000
+# The PostgreSQL planner estimate is used instead of COUNT(*) above this number of rows
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Paginator taking the number of objects from the PostgreSQL planner estimate
+    (EXPLAIN), rather than from a COUNT(*) scanning the whole table
+
+    Small results (under ESTIMATED_COUNT_THRESHOLD rows), and all results on other
+    databases, are counted exactly. The estimate may be off, so the last
+    pages of a large changelist can be empty
+    '''
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+
+def pk_batches(queryset, batch_size=ADMIN_BATCH_SIZE):
+    '''
+    Primary keys of the queryset in batches, in increasing order; each batch is
+    a separate query starting after the last key of the previous one, so that
+    the queryset is never loaded at once
+
+    Yields
+    ------
+    list
+            Primary keys of at most batch_size objects
+    '''
+    queryset = queryset.prefetch_related(None).order_by('pk').values_list('pk', flat=True)
+    last_pk = None
+    while True:
+        batch = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1]
+
+
+def reindex_materials(material_pks):
+    '''
+    Send the materials to the search index, ADMIN_BATCH_SIZE documents per request
+
+    Returns
+    -------
+    int
+            Number of materials indexed
+    '''
+    index = haystack_connections['default'].get_unified_index().get_index(Material)
+    backend = haystack_connections['default'].get_backend()
+    indexed = 0
+    for batch in pk_batches(Material.objects.filter(pk__in=material_pks)):
+        materials = list(index.index_queryset().filter(pk__in=batch))
+        backend.update(index, materials)
+        indexed += len(materials)
+    return indexed
+
+
+def delete_batch(model, pks):
+    '''
+    Delete materials (with their properties) or properties, in the transaction of the caller
+
+    post_delete is not sent for every object: the generation is incremented, the deletions
+    are logged and the facet counts are updated once for the whole batch, as the receivers
+    of post_delete do for a single object
+
+    Parameters
+    ----------
+    model : Material or Property, required
+    pks : list, required
+            Primary keys of the objects to delete
+
+    Returns
+    -------
+    list
+            Primary keys of the deleted materials, to remove from the search index
+    '''
+    if model is Material:
+        # Locked, so that no property is added to them before they are deleted
+        materials = list(Material.objects.select_for_update().filter(pk__in=pks)
+                         .only('compound', 'elements', 'groups', 'periods'))
+        # Selected by material rather than by their own keys, which can be many more than the materials
+        property_query = Property.objects.filter(compound__in=[material.pk for material in materials])
+    else:
+        materials = []
+        property_query = Property.objects.filter(pk__in=pks)
+    properties = list(property_query)
+
+    counts = Counter()
+    for material in materials:
+        for facet, values in material.facet_values().items():
+            for value in values:
+                counts[facet, value] -= 1
+    for material_property in properties:
+        counts[FacetCount.PROPERTY, material_property.propertyName] -= 1
+
+    Generation.bump()
+    Change.objects.bulk_create([Change.entry(instance, Change.DELETE) for instance in properties + materials])
+    FacetCount.add_counts(counts)
+    # Delete the rows without collecting the objects again and sending signals
+    property_query._raw_delete(property_query.db)
+    Material.objects.filter(pk__in=[material.pk for material in materials])._raw_delete(Material.objects.db)
+    return [material.pk for material in materials]
+
+
+def unindex_materials(material_pks):
+    '''
+    Remove the materials from the search index, in a single request
+    '''
+    backend = haystack_connections['default'].get_backend()
+    backend.remove_many(['{}.{}'.format(Material._meta.label_lower, pk) for pk in material_pks])
+
+
+def delete_in_batches(modeladmin, request, queryset):
+    '''
+    Delete the selected objects ADMIN_BATCH_SIZE at a time, each batch in its own
+    transaction (see delete_batch), after a confirmation page that does not list the objects
+    '''
+    if not modeladmin.has_delete_permission(request):
+        raise PermissionDenied
+    opts = modeladmin.model._meta
+    if request.POST.get('post'):
+        deleted = 0
+        for batch in pk_batches(queryset):
+            with transaction.atomic():
+                material_pks = delete_batch(modeladmin.model, batch)
+            unindex_materials(material_pks)
+            deleted += len(batch)
+        modeladmin.message_user(request, "Deleted {} {}.".format(deleted, opts.verbose_name_plural.lower()),
+                                messages.SUCCESS)
+        return None
+
+    select_across = request.POST.get('select_across') == '1'
+    context = dict(
+        modeladmin.admin_site.each_context(request),
+        title="Are you sure?",
+        opts=opts,
+        count=EstimatedCountPaginator(queryset, 1).count,
+        # With select_across, the objects are those matching the filters in the url,
+        # and only the keys of the page are posted
+        select_across=select_across,
+        selected=request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+    )
+    return TemplateResponse(request, 'admin/data/delete_in_batches.html', context)
+
+
+delete_in_batches.short_description = "Delete selected %(verbose_name_plural)s in batches"
+
+
+class PropertyInline(admin.TabularInline):
+    model = Property
+    fields = ('propertyName', 'propertyValue')
+    extra = 0
+
+
+@admin.register(Material)
+class MaterialAdmin(admin.ModelAdmin):
+    list_display = ('compound', 'elements', 'property_names')
+    # Formulas are case sensitive: searched by prefix, which uses the index on compound
+    search_fields = ('compound',)
+    inlines = (PropertyInline,)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('reindex', 'export_csv', delete_in_batches)
+
+    def get_queryset(self, request):
+        # The properties of a page of materials are loaded in a single query
+        return super(MaterialAdmin, self).get_queryset(request).prefetch_related('properties')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(compound__startswith=search_term.strip()), False
+
+    def get_actions(self, request):
+        # Replaced by delete_in_batches
+        actions = super(MaterialAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def save_related(self, request, form, formsets, change):
+        super(MaterialAdmin, self).save_related(request, form, formsets, change)
+        # Save the material again to update the csv field, needed for search indexing
+        form.instance.save()
+
+    def property_names(self, material):
+        return ", ".join(material_property.propertyName for material_property in material.properties.all())
+
+    property_names.short_description = "Properties"
+
+    def reindex(self, request, queryset):
+        indexed = reindex_materials(queryset.values('pk'))
+        self.message_user(request, "Sent {} materials to the search index.".format(indexed), messages.SUCCESS)
+
+    reindex.short_description = "Reindex selected materials"
+
+    def export_csv(self, request, queryset):
+        '''
+        Stream the selected materials as a csv file, in the format accepted by the upload form
+
+        Like searches, the materials are read from a replica unless the user has just written
+        to the database, and the file is compressed with brotli or gzip if the browser accepts it
+        '''
+        def rows():
+            yield "Chemical formula,Property 1 name,Property 1 value\n"
+            for batch in pk_batches(queryset):
+                for csv in Material.objects.filter(pk__in=batch).order_by('pk').values_list('csv', flat=True):
+                    yield csv + "\n"
+
+        def replica_rows():
+            # The rows are read while the response is streamed, after the action has returned
+            with replica_reads():
+                yield from rows()
+
+        content = rows() if PIN_COOKIE in request.COOKIES else replica_rows()
+        response = StreamingHttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="materials.csv"'
+        return CompressionMiddleware().process_response(request, response)
+
+    export_csv.short_description = "Export selected materials as csv"
+
+
+@admin.register(Property)
+class PropertyAdmin(admin.ModelAdmin):
+    list_display = ('propertyName', 'propertyValue', 'compound')
+    # Property.__str__ and the compound column read the material: join it in the changelist query
+    list_select_related = ('compound',)
+    # Property names are searched by prefix, which uses the index on propertyName
+    search_fields = ('propertyName',)
+    # A select listing every material would be loaded with the change form
+    raw_id_fields = ('compound',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('reindex', delete_in_batches)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(propertyName__startswith=search_term.strip()), False
+
+    def get_actions(self, request):
+        actions = super(PropertyAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def save_model(self, request, obj, form, change):
+        super(PropertyAdmin, self).save_model(request, obj, form, change)
+        # Update the csv field of the material, needed for search indexing
+        obj.compound.save()
+
+    def reindex(self, request, queryset):
+        indexed = reindex_materials(queryset.values('compound'))
+        self.message_user(request, "Sent {} materials to the search index.".format(indexed), messages.SUCCESS)
+
+    reindex.short_description = "Reindex materials of selected properties"
@@ -0,0 +1,172 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+from data.models import Material
+from data.tools import operator_type
+
+
+# Cost of the parts of a search query, in arbitrary units (see search_cost)
+# Full-text search matching every material: no search at all, "*", or an empty search
+# (which haystack sends to Elasticsearch as *:*)
+MATCH_ALL_COST = 10
+# Plain term, optionally restricted to a field: element:Pb
+TERM_COST = 1
+# Leading wildcard, regular expression or fuzzy term: scans the whole term dictionary
+SCAN_TERM_COST = 5
+# Property filter, by database lookup; the property name is always matched with icontains
+PROPERTY_COSTS = {
+    'exact': 2,
+    'iexact': 3,
+    'gt': 3, 'gte': 3, 'lt': 3, 'lte': 3,
+    'contains': 4,
+    'icontains': 4,
+}
+
+MATCH_ALL_SEARCHES = ('', '*', '*:*')
+LUCENE_KEYWORDS = ('AND', 'OR', 'NOT', '&&', '||', '!')
+SCAN_TERM = re.compile(r'^(\w+:)?[*?]|^(\w+:)?/|~')
+
+
+class SearchUnavailable(Exception):
+    '''
+    The search engine timed out or failed
+    '''
+    pass
+
+
+class TooManyResults(Exception):
+    '''
+    The search matches more than the maximal number of materials
+    '''
+    pass
+
+
+def matches_all(query_dictionary):
+    '''
+    True if the full-text part of the search query matches every material
+    '''
+    search = query_dictionary.get("search")
+    return search is None or search.strip() in MATCH_ALL_SEARCHES
+
+
+def search_cost(query_dictionary):
+    '''
+    Estimate the cost of a search query before running it
+
+    Parameters
+    ----------
+    query_dictionary : dict, required
+                        Search query represented by a dictionary, conforming to the search schema
+
+    Returns
+    -------
+    int
+            Estimated cost, in the units of MATCH_ALL_COST, TERM_COST, etc.
+    '''
+    cost = 0
+    if matches_all(query_dictionary):
+        cost += MATCH_ALL_COST
+    else:
+        for term in query_dictionary["search"].replace('(', ' ').replace(')', ' ').split():
+            if term in LUCENE_KEYWORDS:
+                continue
+            cost += SCAN_TERM_COST if SCAN_TERM.search(term) else TERM_COST
+    for compound_property in query_dictionary.get("properties", []):
+        operator = operator_type(compound_property["logic"])
+        cost += PROPERTY_COSTS.get(operator, max(PROPERTY_COSTS.values()))
+    return cost
+
+
+# Heavy searches running at the same time: on PostgreSQL, the slots are advisory locks
+# of the primary database (HEAVY_SLOTS_LOCK_KEY, slot number), shared by all the worker
+# processes; on other databases (development servers), a semaphore of this process
+HEAVY_SLOTS_LOCK_KEY = 7101
+_heavy_searches = threading.BoundedSemaphore(settings.SEARCH_HEAVY_SLOTS)
+
+
+def _acquire_heavy_slot(connection):
+    '''
+    Number of the advisory lock taken for a heavy search, or None if all of them are held
+    '''
+    with connection.cursor() as cursor:
+        for slot in range(settings.SEARCH_HEAVY_SLOTS):
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [HEAVY_SLOTS_LOCK_KEY, slot])
+            if cursor.fetchone()[0]:
+                return slot
+    return None
+
+
+@contextmanager
+def search_slot(cost):
+    '''
+    Admit a search of a given cost: cheap searches are always admitted, heavy ones
+    (cost of at least SEARCH_HEAVY_COST) only if one of SEARCH_HEAVY_SLOTS is free
+
+    On PostgreSQL, the slots are session advisory locks of the primary database, so
+    the limit holds across all the worker processes and servers; a lock is also
+    released by the database if the worker dies. Replicas are not used, since
+    advisory locks are not shared between a primary and its standbys
+
+    Yields
+    ------
+    bool
+            True if the search is admitted; the slot is released when the block ends
+    '''
+    if cost < settings.SEARCH_HEAVY_COST:
+        yield True
+        return
+    # Not router.db_for_write, which would pin the client to the primary database
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor == 'postgresql':
+        slot = _acquire_heavy_slot(connection)
+        if slot is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [HEAVY_SLOTS_LOCK_KEY, slot])
+    elif not _heavy_searches.acquire(blocking=False):
+        yield False
+    else:
+        try:
+            yield True
+        finally:
+            _heavy_searches.release()
+
+
+@contextmanager
+def statement_timeout(seconds):
+    '''
+    Abort the database statements of the block that run longer than seconds,
+    raising django.db.OperationalError
+
+    Uses statement_timeout on PostgreSQL and a progress handler on SQLite;
+    does nothing with other databases. The database is the one reads of
+    materials are routed to (a replica inside replica_reads blocks)
+    '''
+    alias = router.db_for_read(Material)
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        with transaction.atomic(using=alias):
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", [int(seconds * 1000)])
+            yield
+    elif connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        deadline = time.monotonic() + seconds
+        # The handler is called every 10000 virtual machine instructions;
+        # a non-zero return value interrupts the statement
+        connection.connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+        try:
+            yield
+        finally:
+            connection.connection.set_progress_handler(None, 0)
+    else:
+        yield
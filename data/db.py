@@ -1,6 +1,12 @@
+import hashlib
 import json
-from data.models import Material
+from collections import Counter
+from django.db.models import CharField, Count, Q, Value
+from django.db.models.functions import Concat
+from data.admission import TooManyResults, matches_all
+from data.models import Material, Property, FacetCount, batch_writes
 from data.tools import valid_float, operator_type, valid_operator_type
+from data.units import parse_value
 from haystack.query import SearchQuerySet
 from data.serializers import MaterialSerializer
 from jsonschema import validate
@@ -63,29 +69,31 @@ def db_from_csv(csv_file):
 
     materials_total = 0
     materials_added = 0
-    for line in lines:
-        fields = line.strip().split(',')
-
-        n_fields = len(fields)
-        # take care of possible dos line endings when you end up with an empty string
-        if n_fields < 2 and fields[0] == '':
-            continue
-        materials_total += 1
-        # Skip the record if the total number of fields is odd:
-        # Supposed to be one compound name & n properties (2*n + 1)
-        if n_fields % 2 == 0:
-            continue
-
-        material = Material(compound=fields[0])
-        material_saved = save_to_db(material)
-        if not material_saved:
-            continue
-        [material.properties.create(propertyName=fields[n], propertyValue=fields[n+1]) for n in range(1,n_fields-1,2)]
-        # Save the material again to update the csv field, needed for search indexing
-        material_saved = save_to_db(material)
-        if not material_saved:
-            continue
-        materials_added += 1
+    # The file is added in one transaction; the change log and the facet counts are written at its end
+    with batch_writes():
+        for line in lines:
+            fields = line.strip().split(',')
+
+            n_fields = len(fields)
+            # take care of possible dos line endings when you end up with an empty string
+            if n_fields < 2 and fields[0] == '':
+                continue
+            materials_total += 1
+            # Skip the record if the total number of fields is odd:
+            # Supposed to be one compound name & n properties (2*n + 1)
+            if n_fields % 2 == 0:
+                continue
+
+            material = Material(compound=fields[0])
+            material_saved = save_to_db(material)
+            if not material_saved:
+                continue
+            [material.properties.create(propertyName=fields[n], propertyValue=fields[n+1]) for n in range(1,n_fields-1,2)]
+            # Save the material again to update the csv field, needed for search indexing
+            material_saved = save_to_db(material)
+            if not material_saved:
+                continue
+            materials_added += 1
 
     return "{} of {} materials added to the database".format(materials_added, materials_total), 200
 
@@ -154,7 +162,29 @@ def json_to_dictionary(request_body, request_type):
     return dictionary
 
 
-def query_from_dictionary(query_dictionary):
+def search_etag(query_dictionary, generation):
+    '''
+    ETag of the result of a search query at a given database generation
+
+    Parameters
+    ----------
+    query_dictionary : dict, required
+                        Search query represented by a dictionary, obtained from user's json
+    generation : int, required
+                        Current write generation of the database (Generation model)
+
+    Returns
+    -------
+    string
+                Quoted ETag; equal for the same query and generation, whatever
+                the order of the keys in the user's json
+    '''
+    normalized_query = json.dumps(query_dictionary, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha1(normalized_query.encode('utf-8')).hexdigest()
+    return '"{}-{}"'.format(generation, digest)
+
+
+def query_from_dictionary(query_dictionary, max_results=None):
     '''
     Create db query from a dictionary
 
@@ -162,6 +192,9 @@ def query_from_dictionary(query_dictionary):
     ----------
     query_dictionary : dict, required
                         Query represented by a dictionary, obtained from user's json
+    max_results : int, optional
+                        Maximal number of materials matched by the full-text search
+                        (or by the property filters alone, if the full-text search matches everything)
 
     Returns
     -------
@@ -171,6 +204,11 @@ def query_from_dictionary(query_dictionary):
     string
                 Error message if there were any errors
 
+    Raises
+    ------
+    TooManyResults
+                If the search matches more than max_results materials
+
     Depends
     -------
     Material model class
@@ -178,13 +216,19 @@ def query_from_dictionary(query_dictionary):
     query = Material.objects
     # First, apply the raw search filter through haystack API
     # Since input json conforms to the schema, parse it without further checks
-    if "search" in query_dictionary:
+    # (a search matching everything is not sent to the search engine at all)
+    if not matches_all(query_dictionary):
         search_query = SearchQuerySet().raw_search(query_dictionary["search"])
-        # Convert haystack search query to django search query
-        try:
-            query = Material.objects.filter(pk__in=[material.object.pk for material in search_query])
-        except AttributeError:  # compounds were found in the index but not in database
-            return "Search index is out of sync with the database"
+        if max_results is not None:
+            # The property filters are applied to the primary keys of all the hits:
+            # count them first, then fetch them in a single request to the search engine
+            if search_query.count() > max_results:
+                raise TooManyResults(max_results)
+            search_query = search_query[:max_results]
+        # Convert haystack search query to django search query; the primary keys
+        # are taken from the index, without loading every result from the database
+        # (compounds found in the index but not in the database are skipped)
+        query = Material.objects.filter(pk__in=[result.pk for result in search_query])
     if "properties" in query_dictionary:
         # Now filter by property values
         for compound_property in query_dictionary["properties"]:
@@ -192,11 +236,24 @@ def query_from_dictionary(query_dictionary):
             property_value = compound_property["value"]
             property_logic = compound_property["logic"]
             operator = operator_type(property_logic)
-            # Process requests that are floats
-            if valid_float(property_value) and valid_operator_type(operator, data_type=float):
-                query = query.filter(properties__propertyName__icontains=property_name,
-                    **{'properties__propertyValueFloat__' + operator: float(property_value)}
-                    )
+            quantity = parse_value(property_value)
+            # Process requests that are numbers, optionally with a unit: compare them in canonical
+            # units with the whole range of the stored values (the bounds are equal for single values);
+            # exact matches only the values with the same bounds, not every range with the same middle
+            if quantity is not None and valid_operator_type(operator, data_type=float):
+                _, unit, low, high = quantity
+                filters = {
+                    'exact': {'properties__propertyValueMin': low, 'properties__propertyValueMax': high},
+                    'gt': {'properties__propertyValueMin__gt': high},
+                    'gte': {'properties__propertyValueMin__gte': low},
+                    'lt': {'properties__propertyValueMax__lt': low},
+                    'lte': {'properties__propertyValueMax__lte': high},
+                }[operator]
+                # Values without a unit are compared with all the values of the property,
+                # in canonical units (a filter "< 30" does not match "25 °C", stored as 298.15 K)
+                if unit:
+                    filters['properties__propertyUnit'] = unit
+                query = query.filter(properties__propertyName__icontains=property_name, **filters)
             # Process requests that are strings
             elif not valid_float(property_value) and valid_operator_type(operator, data_type=str):
                 query = query.filter(properties__propertyName__icontains=property_name,
@@ -206,9 +263,68 @@ def query_from_dictionary(query_dictionary):
                 return "Incorrect search operator"
             else:
                 return "Incorrect combination of the property value and operator"
+    if max_results is not None and matches_all(query_dictionary):
+        # Without a full-text search, count the materials matching the property filters
+        # in the database, stopping after max_results + 1 of them
+        if Material.objects.filter(pk__in=query.values('pk'))[:max_results + 1].count() > max_results:
+            raise TooManyResults(max_results)
     return query
 
 
+def facet_counts(query=None):
+    '''
+    Count the materials per element, group and period, and the properties per property name
+
+    Parameters
+    ----------
+    query : QuerySet object, optional
+            QuerySet of the materials to count, from query_from_dictionary;
+            all the materials in the database if not given
+
+    Returns
+    -------
+    dict
+            Total number of materials, and the counts of every facet
+            ({value: count}, largest first), keyed by the facet name
+    '''
+    counts = {facet: Counter() for facet in FacetCount.FACETS}
+    if query is None:
+        # Read the counts maintained on every write to the database
+        total = 0
+        for facet, value, count in FacetCount.objects.filter(count__gt=0).values_list('facet', 'value', 'count'):
+            if facet == FacetCount.TOTAL:
+                total = count
+            else:
+                counts[facet][value] = count
+    else:
+        # Property filters join the properties table: count every material once
+        materials = Material.objects.filter(pk__in=query.values('pk'))
+        # The materials are counted in the database, in a single query, for every element,
+        # group and period in the database; the comma-separated columns are padded with
+        # commas, so that a value is matched by ",value," wherever it is in the list
+        columns = {FacetCount.ELEMENT: 'elements', FacetCount.GROUP: 'groups', FacetCount.PERIOD: 'periods'}
+        materials_padded = materials.annotate(**{
+            'padded_' + column: Concat(Value(','), column, Value(','), output_field=CharField())
+            for column in columns.values()})
+        values = list(FacetCount.objects.filter(facet__in=columns, count__gt=0).values_list('facet', 'value'))
+        aggregates = {
+            'count_{}'.format(i): Count('pk', filter=Q(**{
+                'padded_{}__contains'.format(columns[facet]): ',{},'.format(value)}))
+            for i, (facet, value) in enumerate(values)}
+        aggregates[FacetCount.TOTAL] = Count('pk')
+        aggregated = materials_padded.aggregate(**aggregates)
+        total = aggregated[FacetCount.TOTAL]
+        for i, (facet, value) in enumerate(values):
+            if aggregated['count_{}'.format(i)]:
+                counts[facet][value] = aggregated['count_{}'.format(i)]
+        properties = (Property.objects.filter(compound__in=materials)
+                      .values_list('propertyName').annotate(count=Count('id')).order_by())
+        counts[FacetCount.PROPERTY].update(dict(properties))
+    result = {facet: dict(counter.most_common()) for facet, counter in counts.items()}
+    result[FacetCount.TOTAL] = total
+    return result
+
+
 def query_to_dictionary(query):
     '''
     Return materials satisfying the search query
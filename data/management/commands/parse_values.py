@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from data.models import Property, Generation, Change
+from data.units import parse_value
+
+
+NUMERIC_FIELDS = ('propertyValueFloat', 'propertyUnit', 'propertyValueMin', 'propertyValueMax')
+
+
+class Command(BaseCommand):
+    help = ('Parse the values of the existing properties into their numerical magnitude, unit and bounds '
+            '(as Property.save does for new ones). Properties are read in batches of primary keys, and '
+            'the rows of a batch with the same value are updated by a single statement.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of properties read and updated in one transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        queryset = Property.objects.order_by('pk').only('compound', 'propertyName', 'propertyValue', *NUMERIC_FIELDS)
+        last_pk = 0
+        checked = 0
+        updated = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            # Properties to update, by their new numerical columns
+            changes = defaultdict(list)
+            for row in batch:
+                parsed = parse_value(row.propertyValue) or (None, None, None, None)
+                if parsed != tuple(getattr(row, field) for field in NUMERIC_FIELDS):
+                    for field, value in zip(NUMERIC_FIELDS, parsed):
+                        setattr(row, field, value)
+                    changes[parsed].append(row)
+            if changes:
+                with transaction.atomic():
+                    # Queryset updates do not send signals: increment the generation,
+                    # which invalidates cached search results, and log the changes
+                    Generation.bump()
+                    for parsed, rows in changes.items():
+                        Property.objects.filter(pk__in=[row.pk for row in rows]).update(**dict(zip(NUMERIC_FIELDS, parsed)))
+                    Change.objects.bulk_create(
+                        [Change.entry(row, Change.UPDATE) for rows in changes.values() for row in rows])
+            checked += len(batch)
+            updated += sum(len(rows) for rows in changes.values())
+            last_pk = batch[-1].pk
+            if options['verbosity'] > 1:
+                self.stdout.write('Checked {} properties, updated {}'.format(checked, updated))
+
+        self.stdout.write('Parsed the values of {} properties, {} of them changed'.format(checked, updated))
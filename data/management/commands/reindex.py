@@ -0,0 +1,180 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections as db_connections
+from django.db.models import Max, Min
+from haystack import connections as haystack_connections
+
+from data.models import Material
+
+
+# Each worker gets several pk slices, so that gaps in the pk sequence
+# (deleted materials) do not leave some workers idle while others are busy
+SLICES_PER_WORKER = 4
+
+
+def pk_slices(pk_min, pk_max, n_slices):
+    '''
+    Split the range of primary keys into contiguous slices
+
+    Parameters
+    ----------
+    pk_min : int, required
+                Smallest primary key in the table
+    pk_max : int, required
+                Largest primary key in the table
+    n_slices : int, required
+                Number of slices to split the range into
+
+    Returns
+    -------
+    list
+            List of (start, end) tuples; start is inclusive, end is exclusive
+    '''
+    step = max(1, -(-(pk_max - pk_min + 1) // n_slices))
+    return [(start, min(start + step, pk_max + 1)) for start in range(pk_min, pk_max + 1, step)]
+
+
+def index_slice(args):
+    '''
+    Index all materials with primary keys in [start, end)
+
+    Materials are read in pk order with keyset pagination (no OFFSET), and each
+    batch is sent to Elasticsearch as a single bulk request (by MaterialsSearchBackend.update)
+
+    Parameters
+    ----------
+    args : tuple, required
+                (using, index_name, start, end, batch_size)
+
+    Returns
+    -------
+    int
+            Number of materials indexed
+    '''
+    using, index_name, start, end, batch_size = args
+
+    # Worker processes must not share database or Elasticsearch connections with the parent
+    db_connections.close_all()
+    engine = haystack_connections[using]
+    engine.reset_sessions()
+    backend = engine.get_backend()
+    backend.index_name = index_name
+    # The index and its mapping are created by the parent process
+    backend.setup_complete = True
+    index = engine.get_unified_index().get_index(Material)
+
+    queryset = index.index_queryset(using=using).filter(pk__gte=start, pk__lt=end).order_by('pk')
+    indexed = 0
+    last_pk = None
+    while True:
+        batch_query = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_query[:batch_size])
+        if not batch:
+            break
+        backend.update(index, batch, commit=False)
+        indexed += len(batch)
+        last_pk = batch[-1].pk
+    return indexed
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the materials search index from scratch, in parallel. The primary key range is split '
+            'between worker processes which send bulk requests to Elasticsearch. The live index is cleared '
+            'first; with --swap, a new index is built next to the live one instead, and the index alias '
+            'is switched to it once it is complete.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='Number of worker processes; 0 indexes in the current process')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of materials sent to Elasticsearch in one bulk request')
+        parser.add_argument('--using', default='default',
+                            help='Haystack connection to rebuild')
+        parser.add_argument('--swap', action='store_true',
+                            help='Build a new index and atomically point the index alias to it')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='With --swap, do not delete the indices previously behind the alias')
+
+    def handle(self, *args, **options):
+        using = options['using']
+        workers = options['workers']
+        batch_size = options['batch_size']
+        if workers < 0 or batch_size < 1:
+            raise CommandError('--workers must be non-negative and --batch-size must be positive')
+
+        backend = haystack_connections[using].get_backend()
+        if not hasattr(backend, 'conn'):
+            raise CommandError('The "{}" haystack connection is not an Elasticsearch backend'.format(using))
+        alias = backend.index_name
+        if options['swap']:
+            index_name = '{}_{}'.format(alias, time.strftime('%Y%m%d%H%M%S'))
+        else:
+            index_name = alias
+
+        backend.index_name = index_name
+        if not options['swap']:
+            # Rebuild the live index from scratch, as rebuild_index does, so that documents
+            # of deleted materials do not stay searchable (search is empty until it is filled)
+            backend.clear()
+        # Create the index with the mapping built from MaterialIndex before the workers start
+        backend.setup()
+        if options['swap']:
+            # Nobody searches the new index yet, so skip periodic refreshes while it is being filled
+            backend.conn.indices.put_settings(index=index_name, body={'index': {'refresh_interval': '-1'}})
+
+        bounds = Material.objects.aggregate(pk_min=Min('pk'), pk_max=Max('pk'))
+        indexed = 0
+        if bounds['pk_min'] is not None:
+            slices = pk_slices(bounds['pk_min'], bounds['pk_max'], max(workers, 1) * SLICES_PER_WORKER)
+            tasks = [(using, index_name, start, end, batch_size) for start, end in slices]
+            if workers == 0:
+                indexed = sum(index_slice(task) for task in tasks)
+            else:
+                # Do not hand the open database connection over to the forked workers
+                db_connections.close_all()
+                with multiprocessing.Pool(workers) as pool:
+                    indexed = sum(pool.imap_unordered(index_slice, tasks))
+
+        if options['swap']:
+            backend.conn.indices.put_settings(index=index_name, body={'index': {'refresh_interval': '1s'}})
+        backend.conn.indices.refresh(index=index_name)
+        self.stdout.write('Indexed {} materials into "{}"'.format(indexed, index_name))
+
+        if options['swap']:
+            self.swap_alias(backend.conn, alias, index_name, keep_old=options['keep_old'])
+        backend.index_name = alias
+
+    def swap_alias(self, conn, alias, index_name, keep_old=False):
+        '''
+        Point the alias to index_name in one atomic operation
+
+        Parameters
+        ----------
+        conn : Elasticsearch client, required
+        alias : str, required
+                    Index name used by the application (INDEX_NAME in the haystack settings)
+        index_name : str, required
+                    Name of the freshly built index
+        keep_old : bool, optional
+                    Keep the indices the alias pointed to before the swap
+        '''
+        actions = [{'add': {'index': index_name, 'alias': alias}}]
+        old_indices = []
+        if conn.indices.exists_alias(name=alias):
+            old_indices = list(conn.indices.get_alias(name=alias))
+            actions = [{'remove': {'index': old, 'alias': alias}} for old in old_indices] + actions
+        elif conn.indices.exists(index=alias):
+            # The application used to write to a concrete index with the alias name;
+            # it has to go before the alias can be created (search is briefly unavailable)
+            self.stderr.write('"{}" is a concrete index; deleting it to create the alias'.format(alias))
+            conn.indices.delete(index=alias)
+
+        conn.indices.update_aliases(body={'actions': actions})
+        self.stdout.write('Alias "{}" now points to "{}"'.format(alias, index_name))
+
+        if not keep_old:
+            for old in old_indices:
+                conn.indices.delete(index=old, ignore=404)
+                self.stdout.write('Deleted old index "{}"'.format(old))
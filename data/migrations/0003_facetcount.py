@@ -0,0 +1,49 @@
+# Generated by Django 2.0.3 on 2026-10-19 14:02
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_facets(apps, schema_editor):
+    '''
+    Count the facets of the materials and properties already in the database
+    '''
+    Material = apps.get_model('data', 'Material')
+    Property = apps.get_model('data', 'Property')
+    FacetCount = apps.get_model('data', 'FacetCount')
+    counts = Counter()
+    for material in Material.objects.values_list('elements', 'groups', 'periods').iterator():
+        counts['total', ''] += 1
+        for facet, values in zip(('element', 'group', 'period'), material):
+            for value in set(filter(None, values.split(','))):
+                counts[facet, value] += 1
+    for name, count in Property.objects.values_list('propertyName').annotate(count=models.Count('id')).order_by():
+        counts['property', name] += count
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, count=count) for (facet, value), count in counts.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0002_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('element', 'element'), ('group', 'group'), ('period', 'period'), ('property', 'property'), ('total', 'total')], max_length=10, verbose_name='Facet')),
+                ('value', models.CharField(max_length=100, verbose_name='Value')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Count')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='facetcount',
+            unique_together={('facet', 'value')},
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
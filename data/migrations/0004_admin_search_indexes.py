@@ -0,0 +1,23 @@
+# Generated by Django 2.0.3 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_facetcount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='material',
+            name='compound',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='Compound'),
+        ),
+        migrations.AlterField(
+            model_name='property',
+            name='propertyName',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='Property name'),
+        ),
+    ]
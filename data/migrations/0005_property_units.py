@@ -0,0 +1,38 @@
+# Generated by Django 2.0.3 on 2026-10-19 16:25
+
+from django.db import migrations, models
+
+
+def copy_numbers(apps, schema_editor):
+    '''
+    Plain numbers are their own bounds; values with units are parsed by the parse_values command
+    '''
+    Property = apps.get_model('data', 'Property')
+    Property.objects.filter(propertyValueFloat__isnull=False).update(
+        propertyUnit='', propertyValueMin=models.F('propertyValueFloat'), propertyValueMax=models.F('propertyValueFloat'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='propertyUnit',
+            field=models.CharField(blank=True, db_index=True, default=None, max_length=10, null=True, verbose_name='Unit'),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='propertyValueMax',
+            field=models.FloatField(blank=True, db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='propertyValueMin',
+            field=models.FloatField(blank=True, db_index=True, default=None, null=True),
+        ),
+        migrations.RunPython(copy_numbers, migrations.RunPython.noop),
+    ]
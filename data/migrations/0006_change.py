@@ -0,0 +1,46 @@
+# Generated by Django 2.0.3 on 2026-10-19 17:40
+
+import json
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def log_existing(apps, schema_editor):
+    '''
+    Log the materials and properties already in the database as created,
+    so that clients starting from the beginning of the log get all of them
+    '''
+    Material = apps.get_model('data', 'Material')
+    Property = apps.get_model('data', 'Property')
+    Change = apps.get_model('data', 'Change')
+    changes = (Change(model='material', object_id=pk, action='create', data=json.dumps({'compound': compound}))
+               for pk, compound in Material.objects.order_by('pk').values_list('pk', 'compound').iterator())
+    Change.objects.bulk_create(changes, batch_size=1000)
+    fields = ('material', 'propertyName', 'propertyValue', 'propertyValueFloat', 'propertyUnit',
+              'propertyValueMin', 'propertyValueMax')
+    changes = (Change(model='property', object_id=row[0], action='create', data=json.dumps(dict(zip(fields, row[1:]))))
+               for row in Property.objects.order_by('pk').values_list('pk', 'compound_id', *fields[1:]).iterator())
+    Change.objects.bulk_create(changes, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0005_property_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False, verbose_name='Sequence number')),
+                ('model', models.CharField(max_length=10, verbose_name='Model')),
+                ('object_id', models.IntegerField(verbose_name='Object id')),
+                ('action', models.CharField(choices=[('create', 'create'), ('update', 'update'), ('delete', 'delete')], max_length=10, verbose_name='Action')),
+                ('data', models.TextField(verbose_name='Data')),
+                ('time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time')),
+            ],
+        ),
+        migrations.RunPython(log_existing, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,15 @@
-from django.db import models
-from data.tools import valid_float
-from pyEQL import chemical_formula
-from pyEQL import elements as Elements
+import json
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from data.units import parse_value
+from data import periodic_table
 
 
 # SQL database schema: Material <-- [Property, Property, ...]
@@ -10,7 +18,7 @@ class Material(models.Model):
     '''
     Material in the database
     '''
-    compound = models.CharField('Compound',max_length=100)
+    compound = models.CharField('Compound',max_length=100, db_index=True)
     elements = models.CharField('Elements', max_length=100, blank=True)
     periods = models.CharField('Periods', max_length=100, blank=True)
     groups = models.CharField('Groups, CAS', max_length=100, blank=True)
@@ -22,6 +30,32 @@ class Material(models.Model):
     def __str__(self):
         return self.compound
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Material, cls).from_db(db, field_names, values)
+        # Remember the facet columns of the material as loaded, to count only the changes on save
+        # (the sets of values are only computed by save, not for every material read)
+        if all(field in field_names for field in ('elements', 'groups', 'periods')):
+            instance._counted_columns = (instance.elements, instance.groups, instance.periods)
+        return instance
+
+    def facet_values(self):
+        '''
+        Facet values of the material, counted in FacetCount
+
+        Returns
+        -------
+        dict
+                Sets of elements, groups and periods, keyed by the facet name;
+                every material also counts once in the total
+        '''
+        return {
+            FacetCount.TOTAL: {''},
+            FacetCount.ELEMENT: set(filter(None, self.elements.split(','))),
+            FacetCount.GROUP: set(filter(None, self.groups.split(','))),
+            FacetCount.PERIOD: set(filter(None, self.periods.split(','))),
+        }
+
     # Generate a csv field corresponding to this material entry
     # Used to create search index, but also for possible export
     def to_csv(self):
@@ -37,17 +71,34 @@ class Material(models.Model):
     # containing csv of elements in the compound, as well as groups and periods they belong to
     def save(self, *args, **kwargs):
         # Obtain elements, groups, and periods, and save them to the model
+        # pyEQL (with pint and its unit registry) is slow to import, so load it
+        # only when a formula has to be parsed rather than at module import
+        from pyEQL import chemical_formula
         elements = chemical_formula.get_elements(self.compound)
         periods = set()
         groups = set()
         for element in elements:
-            periods.add(str(Elements.ELEMENTS[element].period))
-            groups.add(str(Elements.ELEMENTS[element].group))
+            periods.add(str(periodic_table.period(element)))
+            groups.add(str(periodic_table.group(element)))
         self.elements = ",".join(elements)
         self.groups = ",".join(groups)
         self.periods = ",".join(periods)
         self.csv = self.to_csv()
-        super(Material, self).save(*args, **kwargs)
+        # Facets counted for the material before this save, if it is in the database already
+        counted = None
+        if not self._state.adding:
+            columns = getattr(self, '_counted_columns', None)
+            if columns is None:
+                columns = Material.objects.filter(pk=self.pk).values_list('elements', 'groups', 'periods').first()
+            if columns is not None:
+                counted = Material(elements=columns[0], groups=columns[1], periods=columns[2]).facet_values()
+        # The counts and the change log are written in the transaction of the row
+        # (in the transaction of the caller if there is one, without a savepoint)
+        with transaction.atomic(savepoint=False):
+            super(Material, self).save(*args, **kwargs)
+            # Update the counts of all materials by the difference with the facets counted before
+            FacetCount.add(self.facet_values(), 1, counted)
+        self._counted_columns = (self.elements, self.groups, self.periods)
 
 
 class Property(models.Model):
@@ -55,10 +106,15 @@ class Property(models.Model):
     Property of the material
     '''
     compound = models.ForeignKey(Material, related_name='properties', on_delete=models.CASCADE)
-    propertyName = models.CharField('Property name', max_length=100)
+    propertyName = models.CharField('Property name', max_length=100, db_index=True)
     propertyValue = models.CharField('Property value', max_length=100)
-    # Store the numerical value of the property for numerical comparison
+    # Store the numerical value of the property for numerical comparison: the magnitude
+    # in canonical units (data.units), and the bounds of a range of values; filters
+    # compare the bounds, so only they are indexed
     propertyValueFloat = models.FloatField(default=None, null=True, blank=True)
+    propertyUnit = models.CharField('Unit', max_length=10, default=None, null=True, blank=True, db_index=True)
+    propertyValueMin = models.FloatField(default=None, null=True, blank=True, db_index=True)
+    propertyValueMax = models.FloatField(default=None, null=True, blank=True, db_index=True)
 
     class Meta:
         verbose_name_plural = "Properties"
@@ -66,8 +122,278 @@ class Property(models.Model):
     def __str__(self):
         return "{} of {}".format(self.propertyName,self.compound)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Property, cls).from_db(db, field_names, values)
+        # Remember the property name counted in FacetCount, to count renames on save
+        if 'propertyName' in field_names:
+            instance._counted_name = instance.propertyName
+        return instance
+
     def save(self, *args, **kwargs):
-        # Check if the propertyValue can be converted to string and store it as a number
-        if valid_float(self.propertyValue):
-            self.propertyValueFloat = float(self.propertyValue)
-        super(Property, self).save(*args, **kwargs)
+        # Check if the propertyValue is a number (with a unit or a range) and store it as a number
+        self.propertyValueFloat, self.propertyUnit, self.propertyValueMin, self.propertyValueMax = \
+            parse_value(self.propertyValue) or (None, None, None, None)
+        # Name counted for the property before this save, if it is in the database already
+        counted = None
+        if not self._state.adding:
+            counted = getattr(self, '_counted_name', None)
+            if counted is None:
+                counted = Property.objects.filter(pk=self.pk).values_list('propertyName', flat=True).first()
+        with transaction.atomic(savepoint=False):
+            super(Property, self).save(*args, **kwargs)
+            counted = {FacetCount.PROPERTY: {counted}} if counted is not None else None
+            FacetCount.add({FacetCount.PROPERTY: {self.propertyName}}, 1, counted)
+        self._counted_name = self.propertyName
+
+
+class Generation(models.Model):
+    '''
+    Write generation of the database: a counter incremented on every change
+    of materials or their properties, used to validate cached search results
+    '''
+    value = models.BigIntegerField('Generation', default=0)
+
+    # The counter is kept in a single row
+    PK = 1
+
+    def __str__(self):
+        return "Generation {}".format(self.value)
+
+    @classmethod
+    def current(cls):
+        '''
+        Return the current generation (a single primary key lookup)
+        '''
+        # get_or_create would route the lookup to the primary database
+        generation = cls.objects.filter(pk=cls.PK).first()
+        if generation is None:
+            generation, _ = cls.objects.get_or_create(pk=cls.PK)
+        return generation
+
+    @classmethod
+    def bump(cls):
+        '''
+        Increment the generation in the database, in the transaction of the caller
+        '''
+        updated = cls.objects.filter(pk=cls.PK).update(value=F('value') + 1)
+        if not updated:
+            cls.objects.get_or_create(pk=cls.PK, defaults={'value': 1})
+
+
+class FacetCount(models.Model):
+    '''
+    Number of materials per facet value (element, group, period), and of properties
+    per property name, in the whole database; kept up to date on every save and delete
+    of materials and properties, so that the counts are read without scanning the tables
+    '''
+    ELEMENT = 'element'
+    GROUP = 'group'
+    PERIOD = 'period'
+    PROPERTY = 'property'
+    # Total number of materials, stored with an empty value
+    TOTAL = 'total'
+    FACETS = (ELEMENT, GROUP, PERIOD, PROPERTY)
+
+    facet = models.CharField('Facet', max_length=10, choices=[(facet, facet) for facet in FACETS + (TOTAL,)])
+    value = models.CharField('Value', max_length=100)
+    count = models.BigIntegerField('Count', default=0)
+
+    class Meta:
+        unique_together = ('facet', 'value')
+
+    def __str__(self):
+        return "{} {}: {}".format(self.facet, self.value, self.count)
+
+    @classmethod
+    def add(cls, facets, delta, counted=None):
+        '''
+        Add delta to the counts of facet values, in the transaction of the caller
+
+        Parameters
+        ----------
+        facets : dict, required
+                    Sets of values keyed by the facet name
+        delta : int, required
+                    Number added to the count of every value
+        counted : dict, optional
+                    Values already counted for the same object: they are left
+                    unchanged if still in facets, and counted with -delta otherwise
+        '''
+        changes = {}
+        for facet, values in facets.items():
+            old_values = counted.get(facet, set()) if counted else set()
+            for value in values - old_values:
+                changes[facet, value] = delta
+            for value in old_values - values:
+                changes[facet, value] = -delta
+        cls.add_counts(changes)
+
+    @classmethod
+    def add_counts(cls, changes):
+        '''
+        Add numbers to the counts of facet values, in the transaction of the caller;
+        the values changed by the same number are updated by a single statement
+
+        Inside a batch_writes block, the numbers are summed and the counts
+        are written once, when the block ends
+
+        Parameters
+        ----------
+        changes : dict, required
+                    Number added to the count, keyed by (facet name, value)
+        '''
+        batch = getattr(_batch, 'writes', None)
+        if batch is not None:
+            batch.facets.update(changes)
+            return
+        for change in set(changes.values()) - {0}:
+            keys = [key for key, key_change in changes.items() if key_change == change]
+            # A single statement updates all the existing rows
+            condition = Q()
+            for facet, value in keys:
+                condition |= Q(facet=facet, value=value)
+            updated = cls.objects.filter(condition).update(count=F('count') + change)
+            if updated < len(keys):
+                existing = set(cls.objects.filter(condition).values_list('facet', 'value'))
+                for facet, value in keys:
+                    if (facet, value) not in existing:
+                        count, created = cls.objects.get_or_create(facet=facet, value=value, defaults={'count': change})
+                        if not created:
+                            cls.objects.filter(pk=count.pk).update(count=F('count') + change)
+
+
+# Deleted materials and properties (also when deleted with a queryset) are uncounted
+@receiver(post_delete, sender=Material)
+def uncount_material(sender, instance, **kwargs):
+    FacetCount.add(instance.facet_values(), -1)
+
+
+@receiver(post_delete, sender=Property)
+def uncount_property(sender, instance, **kwargs):
+    FacetCount.add({FacetCount.PROPERTY: {instance.propertyName}}, -1)
+
+
+class Change(models.Model):
+    '''
+    Append-only log of the changes of materials and properties, for clients
+    synchronizing their copy of the database incrementally (/data/changes)
+
+    Changes are written in the transaction of the change itself, after the generation
+    is incremented: the lock on the Generation row orders the writing transactions,
+    so a change is never committed with a smaller sequence number than one
+    already committed. Sequence numbers of rolled back changes are skipped
+    '''
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    seq = models.BigAutoField('Sequence number', primary_key=True)
+    model = models.CharField('Model', max_length=10)
+    object_id = models.IntegerField('Object id')
+    action = models.CharField('Action', max_length=10, choices=[(action, action) for action in (CREATE, UPDATE, DELETE)])
+    # Fields of the object after the change (before it, for deletions), as json
+    data = models.TextField('Data')
+    time = models.DateTimeField('Time', default=timezone.now)
+
+    def __str__(self):
+        return "{} {} {} {}".format(self.seq, self.action, self.model, self.object_id)
+
+    @staticmethod
+    def fields(instance):
+        '''
+        Fields of a material or property recorded in the log
+        '''
+        if isinstance(instance, Material):
+            return {'compound': instance.compound}
+        return {'material': instance.compound_id, 'propertyName': instance.propertyName,
+                'propertyValue': instance.propertyValue, 'propertyValueFloat': instance.propertyValueFloat,
+                'propertyUnit': instance.propertyUnit, 'propertyValueMin': instance.propertyValueMin,
+                'propertyValueMax': instance.propertyValueMax}
+
+    @classmethod
+    def entry(cls, instance, action):
+        '''
+        Unsaved log entry of a change of a material or property (for bulk_create)
+        '''
+        return cls(model=instance._meta.model_name, object_id=instance.pk, action=action,
+                   data=json.dumps(cls.fields(instance)))
+
+    def to_dict(self):
+        return {'seq': self.seq, 'model': self.model, 'id': self.object_id, 'action': self.action,
+                'time': self.time.isoformat(), 'data': json.loads(self.data)}
+
+
+class WriteBatch(object):
+    '''
+    Generation, change log and facet count updates of the writes of a batch_writes block
+    '''
+    def __init__(self):
+        # Sums of the changes of the facet counts, keyed by (facet name, value)
+        self.facets = Counter()
+        # Unsaved log entries, and the last entry of every object
+        self.changes = []
+        self.last_changes = {}
+
+    def record(self, instance, action):
+        '''
+        Log a change; an update of an object created or updated in the batch
+        only replaces the data of its entry
+        '''
+        key = (instance._meta.model_name, instance.pk)
+        last_change = self.last_changes.get(key)
+        if action == Change.UPDATE and last_change is not None and last_change.action != Change.DELETE:
+            last_change.data = json.dumps(Change.fields(instance))
+        else:
+            self.last_changes[key] = Change.entry(instance, action)
+            self.changes.append(self.last_changes[key])
+
+    def write(self):
+        '''
+        Increment the generation, log the changes and update the facet counts, a few statements in all
+        '''
+        if self.changes:
+            Generation.bump()
+            Change.objects.bulk_create(self.changes)
+        FacetCount.add_counts(self.facets)
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batch_writes():
+    '''
+    Run the block in a single transaction, in which the generation, the change log
+    and the facet counts are written once for all the materials and properties saved
+    and deleted in the block (by bulk imports), rather than on every save
+
+    Nested blocks are part of the outermost one
+    '''
+    if getattr(_batch, 'writes', None) is not None:
+        yield
+        return
+    with transaction.atomic():
+        batch = _batch.writes = WriteBatch()
+        try:
+            yield
+        finally:
+            _batch.writes = None
+        batch.write()
+
+
+# Any write to the data tables invalidates the search results computed before it,
+# and is logged; the receivers run in the transaction of the write
+@receiver([post_save, post_delete], sender=Material)
+@receiver([post_save, post_delete], sender=Property)
+def record_change(sender, instance, signal, created=False, **kwargs):
+    if signal is post_delete:
+        action = Change.DELETE
+    else:
+        action = Change.CREATE if created else Change.UPDATE
+    batch = getattr(_batch, 'writes', None)
+    if batch is not None:
+        batch.record(instance, action)
+        return
+    Generation.bump()
+    Change.entry(instance, action).save()
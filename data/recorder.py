@@ -0,0 +1,54 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve
+
+
+# Names of the url patterns (data/urls.py) whose requests are recorded
+RECORDED_URLS = ('add', 'search', 'facets')
+
+
+class TrafficRecorderMiddleware:
+    '''
+    Record the /data/add, /data/search and /data/facets requests as json lines, for replaying them
+    with benchmarks.loadtest; enabled only if TRAFFIC_RECORD_PATH is set
+
+    Each line holds the time of the request, method, path, query string, body,
+    response status and the time spent in the view. Lines are appended with a
+    single write on a file opened in append mode, so several worker processes
+    can record into the same file.
+    '''
+    def __init__(self, get_response):
+        path = getattr(settings, 'TRAFFIC_RECORD_PATH', None)
+        if not path:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def __call__(self, request):
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            url_name = None
+        if url_name not in RECORDED_URLS:
+            return self.get_response(request)
+
+        # Read the body before the view does, since it may not be available afterwards
+        body = request.body.decode('utf-8', errors='replace')
+        request_time = time.time()
+        start = time.perf_counter()
+        response = self.get_response(request)
+        record = {
+            'time': request_time,
+            'method': request.method,
+            'path': request.path,
+            'query_string': request.META.get('QUERY_STRING', ''),
+            'body': body,
+            'status': response.status_code,
+            'seconds': time.perf_counter() - start,
+        }
+        os.write(self.fd, (json.dumps(record) + '\n').encode('utf-8'))
+        return response
@@ -0,0 +1,120 @@
+import json
+import re
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import decorator_from_middleware
+
+# Optional dependencies: orjson encodes large search results several times
+# faster than the json module, and brotli gives smaller responses than gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+# Brotli quality 11 (the default) is too slow for responses compressed on the fly
+BROTLI_QUALITY = 5
+
+
+def json_dumps(data, indent=False):
+    '''
+    Encode data as json, using orjson if it is installed
+
+    Parameters
+    ----------
+    data : object, required
+                Object to be encoded (dict, list, etc.)
+    indent : bool, optional
+                Indent the output by two spaces, for human readers
+
+    Returns
+    -------
+    bytes
+            utf-8 encoded json
+    '''
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(data, default=DjangoJSONEncoder().default, option=option)
+    return json.dumps(data, cls=DjangoJSONEncoder, indent=2 if indent else None).encode('utf-8')
+
+
+class FastJsonResponse(HttpResponse):
+    '''
+    Drop-in replacement for django's JsonResponse which encodes data with json_dumps
+
+    Parameters
+    ----------
+    data : object, required
+                Object to be encoded; must be a dict unless safe is False
+    safe : bool, optional
+                Only allow dict objects to be serialized (see JsonResponse)
+    indent : bool, optional
+                Indent the output by two spaces
+    '''
+    def __init__(self, data, safe=True, indent=False, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super(FastJsonResponse, self).__init__(content=json_dumps(data, indent=indent), **kwargs)
+
+
+def compress_brotli_sequence(sequence):
+    '''
+    Compress an iterable of bytes (streaming response content) with brotli
+    '''
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    '''
+    Compress the response with brotli if the client accepts it and the brotli
+    module is installed; fall back to gzip (GZipMiddleware) otherwise
+    '''
+    def process_response(self, request, response):
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is None or not re_accepts_brotli.search(accept_encoding):
+            return super(CompressionMiddleware, self).process_response(request, response)
+
+        # Same rules as in GZipMiddleware: skip short or already encoded responses
+        if not response.streaming and len(response.content) < 200:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if response.streaming:
+            response.streaming_content = compress_brotli_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed_content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'br'
+
+        return response
+
+
+# View decorator applying CompressionMiddleware to the responses of a single view
+compress_response = decorator_from_middleware(CompressionMiddleware)
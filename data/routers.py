@@ -0,0 +1,126 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+# Cookie telling that the client has recently written to the database,
+# and should read from the primary database until replicas catch up
+PIN_COOKIE = 'pin_primary'
+
+# Per-thread routing state of the current request
+_state = threading.local()
+
+# Round-robin counter and the time until which a failed replica is skipped
+_counter = itertools.count()
+_down_until = {}
+
+
+def replica_healthy(alias):
+    '''
+    True if a connection to the database can be established (or is already open)
+    '''
+    try:
+        connections[alias].ensure_connection()
+        return True
+    except DatabaseError:
+        return False
+
+
+def choose_replica():
+    '''
+    Choose a read replica in round-robin order, skipping replicas that are down
+
+    Returns
+    -------
+    string
+            Database alias of the replica; the primary database alias
+            if no replicas are configured or none of them is available
+    '''
+    replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+    if not replicas:
+        return DEFAULT_DB_ALIAS
+    now = time.monotonic()
+    start = next(_counter)
+    for offset in range(len(replicas)):
+        alias = replicas[(start + offset) % len(replicas)]
+        if _down_until.get(alias, 0) > now:
+            continue
+        if replica_healthy(alias):
+            return alias
+        _down_until[alias] = now + settings.REPLICA_RETRY_SECONDS
+    return DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    '''
+    Send the reads made inside this block to a read replica
+
+    One replica is chosen for the whole block, so that all queries of a request
+    see the same state of the database
+    '''
+    previous = getattr(_state, 'replica', None)
+    _state.replica = choose_replica()
+    try:
+        yield _state.replica
+    finally:
+        _state.replica = previous
+
+
+def read_from_replica(view):
+    '''
+    View decorator: run the view with reads going to a replica, unless the client
+    wrote to the database recently (read-your-writes)
+    '''
+    @wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        if PIN_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapped_view
+
+
+def pin_primary(response):
+    '''
+    Make the client read from the primary database for REPLICA_PIN_SECONDS
+    '''
+    response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+    return response
+
+
+class ReplicaRouter:
+    '''
+    Database router sending reads to replicas inside replica_reads blocks
+    and all writes to the primary database
+    '''
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary database
+        return True
+
+
+class PrimaryPinningMiddleware:
+    '''
+    Pin the client to the primary database after a request that wrote to it
+    '''
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.wrote = False
+        response = self.get_response(request)
+        if _state.wrote:
+            pin_primary(response)
+        return response
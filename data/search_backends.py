@@ -0,0 +1,102 @@
+from django.conf import settings
+from elasticsearch import TransportError
+from elasticsearch.helpers import bulk
+from haystack.backends.elasticsearch2_backend import (
+    Elasticsearch2SearchBackend, Elasticsearch2SearchEngine, Elasticsearch2SearchQuery)
+from haystack.constants import ID
+from haystack.exceptions import SkipDocument
+from haystack.utils import get_identifier
+
+from data.admission import SearchUnavailable
+
+
+class MaterialsSearchBackend(Elasticsearch2SearchBackend):
+    '''
+    Elasticsearch 2 backend with a time limit on searches
+
+    Elasticsearch stops searching after SEARCH_TIMEOUT seconds. Searches that time out
+    or fail raise SearchUnavailable, instead of returning partial or empty results
+    as haystack does (indexing errors are still handled by haystack)
+    '''
+    def build_search_kwargs(self, query_string, **kwargs):
+        search_kwargs = super(MaterialsSearchBackend, self).build_search_kwargs(query_string, **kwargs)
+        search_kwargs['timeout'] = '{}ms'.format(int(settings.SEARCH_TIMEOUT * 1000))
+        return search_kwargs
+
+    def search(self, query_string, **kwargs):
+        silently_fail = self.silently_fail
+        self.silently_fail = False
+        try:
+            return super(MaterialsSearchBackend, self).search(query_string, **kwargs)
+        except TransportError as e:
+            raise SearchUnavailable("Search engine error: {}".format(e)) from e
+        finally:
+            self.silently_fail = silently_fail
+
+    def update(self, index, iterable, commit=True):
+        '''
+        Index the objects with a single bulk request; haystack sends them in requests
+        of 500 documents (the default chunk size of elasticsearch.helpers.bulk), so the
+        batch sizes of the reindex command and of the admin would not be the request sizes
+        '''
+        if not self.setup_complete:
+            try:
+                self.setup()
+            except TransportError as e:
+                if not self.silently_fail:
+                    raise
+                self.log.error("Failed to add documents to Elasticsearch: %s", e, exc_info=True)
+                return
+
+        documents = []
+        for obj in iterable:
+            try:
+                prepared = index.full_prepare(obj)
+            except SkipDocument:
+                self.log.debug("Indexing for object `%s` skipped", obj)
+                continue
+            document = {key: self._from_python(value) for key, value in prepared.items()}
+            document['_id'] = document[ID]
+            documents.append(document)
+        if not documents:
+            return
+
+        try:
+            bulk(self.conn, documents, index=self.index_name, doc_type='modelresult', chunk_size=len(documents))
+            if commit:
+                self.conn.indices.refresh(index=self.index_name)
+        except TransportError as e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to add %d documents to Elasticsearch: %s", len(documents), e, exc_info=True)
+
+    def remove_many(self, obj_or_strings, commit=True):
+        '''
+        Remove documents from the index with a single bulk request,
+        rather than a request per document as remove does
+        '''
+        doc_ids = [get_identifier(obj_or_string) for obj_or_string in obj_or_strings]
+        if not doc_ids:
+            return
+        try:
+            if not self.setup_complete:
+                self.setup()
+            # Documents missing from the index are not errors
+            bulk(self.conn, ({'_op_type': 'delete', '_id': doc_id} for doc_id in doc_ids),
+                 index=self.index_name, doc_type='modelresult', chunk_size=len(doc_ids), raise_on_error=False)
+            if commit:
+                self.conn.indices.refresh(index=self.index_name)
+        except TransportError as e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to remove %d documents from Elasticsearch: %s", len(doc_ids), e, exc_info=True)
+
+    def _process_results(self, raw_results, **kwargs):
+        if raw_results.get('timed_out'):
+            raise SearchUnavailable("Search engine timed out")
+        return super(MaterialsSearchBackend, self)._process_results(raw_results, **kwargs)
+
+
+class MaterialsSearchEngine(Elasticsearch2SearchEngine):
+    backend = MaterialsSearchBackend
+    query = Elasticsearch2SearchQuery
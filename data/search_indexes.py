@@ -3,12 +3,30 @@ from data.models import Material
 
 
 class MaterialIndex(indexes.SearchIndex, indexes.Indexable):
-    # Use Haystack templates with custom filters that convert commas in the fields to spaces
-    text = indexes.CharField(document=True, use_template=True)
+    # Field values are computed by the prepare_* methods below straight from the
+    # comma-separated columns of the Material model, converting commas to spaces;
+    # this avoids rendering a template per field for every indexed document
+    text = indexes.CharField(document=True)
     compound = indexes.CharField(model_attr='compound')
-    element = indexes.CharField(model_attr='elements', use_template=True)
-    period = indexes.CharField(model_attr='periods', use_template=True)
-    group = indexes.CharField(model_attr='groups', use_template=True)
+    element = indexes.CharField(model_attr='elements')
+    period = indexes.CharField(model_attr='periods')
+    group = indexes.CharField(model_attr='groups')
 
     def get_model(self):
         return Material
+
+    def index_queryset(self, using=None):
+        # Properties are already flattened into the csv column, so no joins are needed
+        return self.get_model().objects.only('compound', 'elements', 'periods', 'groups', 'csv')
+
+    def prepare_text(self, obj):
+        return "{},{}".format(obj.csv, obj.elements).replace(',', ' ')
+
+    def prepare_element(self, obj):
+        return obj.elements.replace(',', ' ')
+
+    def prepare_period(self, obj):
+        return obj.periods.replace(',', ' ')
+
+    def prepare_group(self, obj):
+        return obj.groups.replace(',', ' ')
@@ -1,3 +1,691 @@
-from django.test import TestCase
+import json
+import unittest
+from contextlib import ExitStack, contextmanager
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import gzip
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, OperationalError, router
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.views.decorators.http import condition
+from haystack import connections as haystack_connections
+
+from benchmarks.search_backend import MemorySearchBackend
+from data import admission, db, responses, routers
+from data.search_indexes import MaterialIndex
+from data.admin import reindex_materials
+from data.management.commands import reindex
+from data.search_backends import MaterialsSearchBackend
+from data.models import Material, Property, FacetCount, Generation, Change
+from data.units import parse_value
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_RETRY_SECONDS=30)
+class ReplicaRouterTests(TestCase):
+    '''
+    Routing of reads between the primary database and the two sqlite3 replicas of the test settings
+    '''
+    # Connections to the replicas are opened; no test here writes, since the constraint
+    # checks of the test teardown would run on the replicas while the primary is locked
+    multi_db = True
+
+    def setUp(self):
+        routers._down_until.clear()
+
+    def read_alias(self, request):
+        '''
+        Database a view decorated with read_from_replica reads materials from
+        '''
+        @routers.read_from_replica
+        def view(request):
+            return HttpResponse(router.db_for_read(Material) or DEFAULT_DB_ALIAS)
+
+        return view(request).content.decode()
+
+    def test_round_robin(self):
+        aliases = [routers.choose_replica() for _ in range(4)]
+        self.assertEqual(set(aliases), {'replica1', 'replica2'})
+        self.assertEqual(aliases[0::2], [aliases[0]] * 2)
+        self.assertEqual(aliases[1::2], [aliases[1]] * 2)
+        self.assertNotEqual(aliases[0], aliases[1])
+
+    def test_replica_down_is_skipped(self):
+        with mock.patch.object(routers.connections['replica1'], 'ensure_connection',
+                               side_effect=OperationalError('unable to open database file')) as connect:
+            aliases = [routers.choose_replica() for _ in range(4)]
+        self.assertEqual(aliases, ['replica2'] * 4)
+        # The replica is not tried again for REPLICA_RETRY_SECONDS
+        self.assertEqual(connect.call_count, 1)
+
+    def test_all_replicas_down(self):
+        with mock.patch.object(routers, 'replica_healthy', return_value=False):
+            self.assertEqual(routers.choose_replica(), DEFAULT_DB_ALIAS)
+
+    def test_reads_from_replica(self):
+        request = RequestFactory().get('/data/search')
+        self.assertIn(self.read_alias(request), ('replica1', 'replica2'))
+        # Outside of the view, reads go to the primary database again
+        self.assertEqual(router.db_for_read(Material), DEFAULT_DB_ALIAS)
+
+    def test_pinned_client_reads_from_primary(self):
+        request = RequestFactory().get('/data/search')
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+        self.assertEqual(self.read_alias(request), DEFAULT_DB_ALIAS)
+
+
+class PrimaryPinningTests(TestCase):
+    '''
+    Read-your-writes: a client that wrote to the database is pinned to the primary database
+    '''
+    def test_write_pins_client(self):
+        response = self.client.post('/data/add', data='[{"compound": "Pb1S1", "properties": '
+                                    '[{"propertyName": "Band gap", "propertyValue": "0.41"}]}]',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        # Searches of the client read from the primary database (only the primary database
+        # can be connected to in this test: reading from a replica would fail)
+        response = self.client.get('/data/search', {'query': '{"search": "*"}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+class ParseValueTests(SimpleTestCase):
+    '''
+    Parsing of property values into their magnitude, canonical unit and bounds
+    '''
+    # value, (magnitude, unit, low, high)
+    VALUES = (
+        ('3.19', (3.19, '', 3.19, 3.19)),
+        ('3.19 eV', (3.19, 'eV', 3.19, 3.19)),
+        ('2500 meV', (2.5, 'eV', 2.5, 2.5)),
+        ('25 °C', (298.15, 'K', 298.15, 298.15)),
+        ('77 °F', (298.15, 'K', 298.15, 298.15)),
+        ('~300 K', (300, 'K', 300, 300)),
+        ('5.6e3 kg/m3', (5600, 'kg/m3', 5600, 5600)),
+        ('1.2E-3 g/cm3', (1.2, 'kg/m3', 1.2, 1.2)),
+        ('3 Å', (3e-10, 'm', 3e-10, 3e-10)),
+        ('1.2-1.5', (1.35, '', 1.2, 1.5)),
+        ('1.5 to 1.2 eV', (1.35, 'eV', 1.2, 1.5)),
+        ('3.19 ± 0.05 eV', (3.19, 'eV', 3.14, 3.24)),
+        ('3.19 +/- 0.05', (3.19, '', 3.14, 3.24)),
+        ('-5.2', (-5.2, '', -5.2, -5.2)),
+        ('-1.5--0.5', (-1, '', -1.5, -0.5)),
+        ('-10 to -5 °C', (265.65, 'K', 263.15, 268.15)),
+        ('.5', (0.5, '', 0.5, 0.5)),
+    )
+    REJECTED = ('2H polytype', 'red', '', '3.19 parsecs', 'eV 3.19', '1.2.3')
+
+    def test_values(self):
+        for value, expected in self.VALUES:
+            with self.subTest(value=value):
+                parsed = parse_value(value)
+                self.assertEqual(parsed[1], expected[1])
+                for index in (0, 2, 3):
+                    self.assertAlmostEqual(parsed[index], expected[index], delta=abs(expected[index]) * 1e-9)
+
+    def test_rejected(self):
+        for value in self.REJECTED:
+            with self.subTest(value=value):
+                self.assertIsNone(parse_value(value))
+
+
+class NumericFilterTests(TestCase):
+    '''
+    Property filters comparing numbers in canonical units
+    '''
+    def setUp(self):
+        for compound, value in (('Pb1S1', '1.35'), ('Pb1Se1', '1.2-1.5'), ('Pb1Te1', '25 °C')):
+            Material.objects.create(compound=compound).properties.create(propertyName='Value', propertyValue=value)
+
+    def compounds(self, value, logic):
+        query = db.query_from_dictionary({"properties": [{"name": "Value", "value": value, "logic": logic}]})
+        return sorted(query.values_list('compound', flat=True))
+
+    def test_exact_compares_bounds(self):
+        self.assertEqual(self.compounds('1.35', '='), ['Pb1S1'])
+        self.assertEqual(self.compounds('1.2-1.5', '='), ['Pb1Se1'])
+
+    def test_range_comparisons(self):
+        self.assertEqual(self.compounds('1.3', '>'), ['Pb1S1', 'Pb1Te1'])
+        self.assertEqual(self.compounds('1.1', '>'), ['Pb1S1', 'Pb1Se1', 'Pb1Te1'])
+        self.assertEqual(self.compounds('1.5', '<='), ['Pb1S1', 'Pb1Se1'])
+
+    def test_units(self):
+        # Without a unit, the canonical value (298.15 K) is compared
+        self.assertEqual(self.compounds('30', '<'), ['Pb1S1', 'Pb1Se1'])
+        self.assertEqual(self.compounds('30 °C', '<'), ['Pb1Te1'])
+        self.assertEqual(self.compounds('290 K', '>'), ['Pb1Te1'])
+
+
+def recount_facets():
+    '''
+    Facet counts recomputed from the material and property tables, keyed by (facet, value)
+    '''
+    recount = {(FacetCount.TOTAL, ''): Material.objects.count()}
+    for columns in Material.objects.values_list('elements', 'groups', 'periods'):
+        for facet, column in zip((FacetCount.ELEMENT, FacetCount.GROUP, FacetCount.PERIOD), columns):
+            for value in set(column.split(',')) - {''}:
+                recount[facet, value] = recount.get((facet, value), 0) + 1
+    for name in Property.objects.values_list('propertyName', flat=True):
+        recount[FacetCount.PROPERTY, name] = recount.get((FacetCount.PROPERTY, name), 0) + 1
+    return {key: count for key, count in recount.items() if count}
+
+
+def stored_facet_counts():
+    '''
+    Non-zero facet counts of the FacetCount table, keyed by (facet, value)
+    '''
+    return {(facet, value): count
+            for facet, value, count in FacetCount.objects.exclude(count=0).values_list('facet', 'value', 'count')}
+
+
+class FacetCountTests(TestCase):
+    '''
+    The facet counts kept up to date on every write equal a recount of the tables
+    '''
+    def setUp(self):
+        response = self.client.post('/data/add', data='[{"compound": "Pb1S1", "properties": '
+                                    '[{"propertyName": "Band gap", "propertyValue": "0.41"}, '
+                                    '{"propertyName": "Color", "propertyValue": "black"}]}, '
+                                    '{"compound": "Cd1S1", "properties": '
+                                    '[{"propertyName": "Band gap", "propertyValue": "2.42 eV"}]}]',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def assertCounted(self):
+        self.assertEqual(stored_facet_counts(), recount_facets())
+
+    def test_add(self):
+        self.assertCounted()
+        self.assertEqual(db.facet_counts()['element'], {'S': 2, 'Pb': 1, 'Cd': 1})
+
+    def test_rename(self):
+        material = Material.objects.get(compound='Pb1S1')
+        material.compound = 'Pb1Se1'
+        material.save()
+        material_property = Property.objects.get(propertyName='Color')
+        material_property.propertyName = 'Colour'
+        material_property.save()
+        self.assertCounted()
+        self.assertNotIn('Color', db.facet_counts()['property'])
+
+    def test_cascade_delete(self):
+        Material.objects.get(compound='Pb1S1').delete()
+        self.assertCounted()
+        self.assertEqual(db.facet_counts()['property'], {'Band gap': 1})
+
+    def test_parse_values(self):
+        Property.objects.update(propertyValueFloat=None, propertyUnit=None,
+                                propertyValueMin=None, propertyValueMax=None)
+        call_command('parse_values', stdout=StringIO())
+        self.assertEqual(Property.objects.get(propertyName='Band gap', compound__compound='Cd1S1').propertyUnit, 'eV')
+        self.assertCounted()
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_match_all_reads_counts(self):
+        expected = db.facet_counts()
+        for query_dictionary in ({}, {"search": "*"}, {"search": ""}, {"search": " *:* "}):
+            with self.subTest(query=query_dictionary), self.assertNumQueries(2):
+                # The generation, for the ETag, and the counts
+                response = self.client.get('/data/facets', {'query': json.dumps(query_dictionary)})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content.decode()), expected)
+
+    def test_filtered_counts(self):
+        query = db.query_from_dictionary({"properties": [{"name": "Color", "value": "black", "logic": "="}]})
+        counts = db.facet_counts(query)
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual(counts['element'], {'Pb': 1, 'S': 1})
+        self.assertEqual(counts['property'], {'Band gap': 1, 'Color': 1})
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ChangesTests(TestCase):
+    '''
+    Paging through the change log with /data/changes
+    '''
+    def page(self, since, limit):
+        response = self.client.get('/data/changes', {'since': since, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode())
+
+    def read_changes(self, since, limit):
+        '''
+        Follow the pages from since while there are more; return the changes and the last sequence number
+        '''
+        changes = []
+        while True:
+            page = self.page(since, limit)
+            changes += [(change['model'], change['id'], change['action']) for change in page['changes']]
+            self.assertGreaterEqual(page['next'], since)
+            since = page['next']
+            if not page['more']:
+                return changes, since
+
+    def test_every_change_once(self):
+        expected = []
+        lead = Material.objects.create(compound='Pb1S1')
+        expected.append(('material', lead.pk, 'create'))
+        band_gap = lead.properties.create(propertyName='Band gap', propertyValue='0.41')
+        expected.append(('property', band_gap.pk, 'create'))
+        cadmium = Material.objects.create(compound='Cd1S1')
+        expected.append(('material', cadmium.pk, 'create'))
+        band_gap.propertyValue = '0.42 eV'
+        band_gap.save()
+        expected.append(('property', band_gap.pk, 'update'))
+
+        for limit in (1, 2, 3, 1000):
+            with self.subTest(limit=limit):
+                changes, since = self.read_changes(0, limit)
+                self.assertEqual(changes, expected)
+
+        # Changes made between two reads are on the next pages
+        cadmium_pk = cadmium.pk
+        cadmium.delete()
+        lead.compound = 'Pb1Se1'
+        lead.save()
+        lead_pk = lead.pk
+        lead.delete()
+        changes, next_since = self.read_changes(since, 2)
+        self.assertEqual(changes, [('material', cadmium_pk, 'delete'), ('material', lead_pk, 'update'),
+                                   ('property', band_gap.pk, 'delete'), ('material', lead_pk, 'delete')])
+        self.assertEqual(self.page(next_since, 2), {'changes': [], 'next': next_since, 'more': False})
+
+    def test_bulk_add(self):
+        generation = Generation.current().value
+        response = self.client.post('/data/add', data='[{"compound": "Pb1S1", "properties": '
+                                    '[{"propertyName": "Band gap", "propertyValue": "0.41"}]}, '
+                                    '{"compound": "Cd1S1", "properties": '
+                                    '[{"propertyName": "Band gap", "propertyValue": "2.42"}]}]',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # The second save of a material, updating its csv column, is part of its creation
+        changes = self.page(0, 10)['changes']
+        self.assertEqual([(change['model'], change['action']) for change in changes],
+                         [('material', 'create'), ('property', 'create')] * 2)
+        self.assertEqual(changes[0]['data'], {'compound': 'Pb1S1'})
+        self.assertEqual(Generation.current().value, generation + 1)
+
+    def test_deleted_data(self):
+        material = Material.objects.create(compound='Pb1S1')
+        material_pk = material.pk
+        material.delete()
+        changes = self.page(0, 10)['changes']
+        self.assertEqual([change['action'] for change in changes], ['create', 'delete'])
+        # Deletions carry the fields of the object before it was deleted
+        self.assertEqual(changes[1]['data'], {'compound': 'Pb1S1'})
+        self.assertEqual(changes[1]['id'], material_pk)
+
+    def test_bad_parameters(self):
+        for parameters in ({'since': 'x'}, {'since': -1}, {'limit': 0}, {'limit': 100000}):
+            with self.subTest(parameters=parameters):
+                self.assertEqual(self.client.get('/data/changes', parameters).status_code, 400)
+
+
+class AdvisoryLockConnection(object):
+    '''
+    Stand-in for a PostgreSQL connection of a worker process; the advisory locks
+    held by all the connections sharing the set of locks are in held
+    '''
+    vendor = 'postgresql'
+
+    def __init__(self, held):
+        self.held = held
+        self.result = None
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql, params):
+        key = tuple(params)
+        if 'pg_try_advisory_lock' in sql:
+            self.result = key not in self.held
+            self.held.add(key)
+        else:
+            self.result = key in self.held
+            self.held.discard(key)
+
+    def fetchone(self):
+        return (self.result,)
+
+
+class SearchSlotTests(SimpleTestCase):
+    '''
+    Heavy-search slots held as PostgreSQL advisory locks, shared by the worker processes
+    '''
+    def slots(self, connection, count):
+        '''
+        Enter search_slot count times for heavy searches, in the worker process of connection
+        '''
+        stack = ExitStack()
+        with mock.patch.object(admission, 'connections', {DEFAULT_DB_ALIAS: connection}):
+            admitted = [stack.enter_context(admission.search_slot(settings.SEARCH_HEAVY_COST)) for _ in range(count)]
+        return stack, admitted
+
+    def test_slots_shared_by_processes(self):
+        held = set()
+        first, second = AdvisoryLockConnection(held), AdvisoryLockConnection(held)
+        stack, admitted = self.slots(first, settings.SEARCH_HEAVY_SLOTS)
+        self.assertEqual(admitted, [True] * settings.SEARCH_HEAVY_SLOTS)
+        self.assertEqual(len(held), settings.SEARCH_HEAVY_SLOTS)
+        # Another process finds every slot taken, until the first one releases them
+        rejected, admitted = self.slots(second, 1)
+        rejected.close()
+        self.assertEqual(admitted, [False])
+        stack.close()
+        self.assertEqual(held, set())
+        stack, admitted = self.slots(second, 1)
+        self.assertEqual(admitted, [True])
+        stack.close()
+        self.assertEqual(held, set())
+
+    def test_cheap_searches_take_no_slot(self):
+        held = set()
+        with mock.patch.object(admission, 'connections', {DEFAULT_DB_ALIAS: AdvisoryLockConnection(held)}):
+            with admission.search_slot(settings.SEARCH_HEAVY_COST - 1) as admitted:
+                self.assertTrue(admitted)
+        self.assertEqual(held, set())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class AdmissionTests(TestCase):
+    '''
+    Searches rejected by the admission control of run_search
+    '''
+    def setUp(self):
+        for compound in ('Pb1S1', 'Cd1S1'):
+            Material.objects.create(compound=compound).properties.create(propertyName='Color', propertyValue='black')
+        haystack_connections['default'].get_backend().clear()
+        reindex_materials(Material.objects.values('pk'))
+
+    def tearDown(self):
+        haystack_connections['default'].get_backend().clear()
+
+    def search(self, query_dictionary):
+        return self.client.post('/data/search', data=json.dumps(query_dictionary), content_type='application/json')
+
+    def test_too_expensive(self):
+        response = self.search({"search": "*", "properties": [
+            {"name": name, "value": "black", "logic": "icontains"} for name in ('Color', 'Colour', 'Hue')]})
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("too expensive", json.loads(response.content.decode())["error"])
+
+    @override_settings(SEARCH_MAX_RESULTS=1)
+    def test_too_many_results(self):
+        # Counted by the search engine, or in the database without a full-text search
+        for query_dictionary in ({"search": "element:S"},
+                                 {"search": "element:S", "properties": [{"name": "Color", "value": "black", "logic": "="}]},
+                                 {"properties": [{"name": "Color", "value": "black", "logic": "="}]}):
+            with self.subTest(query=query_dictionary):
+                response = self.search(query_dictionary)
+                self.assertEqual(response.status_code, 413)
+                self.assertIn("more than 1 materials", json.loads(response.content.decode())["error"])
+        self.assertEqual(self.search({"search": "element:Pb"}).status_code, 200)
+
+    def test_no_free_slot(self):
+        with ExitStack() as stack:
+            for _ in range(settings.SEARCH_HEAVY_SLOTS):
+                self.assertTrue(stack.enter_context(admission.search_slot(settings.SEARCH_HEAVY_COST)))
+            response = self.search({"search": "*"})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '1')
+            # Cheap searches are still admitted
+            self.assertEqual(self.search({"search": "element:Pb"}).status_code, 200)
+        self.assertEqual(self.search({"search": "*"}).status_code, 200)
+
+    @override_settings(SEARCH_TIMEOUT=0)
+    def test_statement_timeout(self):
+        # Enough properties for the filter to outlast the timeout
+        material = Material.objects.get(compound='Pb1S1')
+        Property.objects.bulk_create([Property(compound=material, propertyName='Color', propertyValue='white')
+                                      for _ in range(5000)])
+        response = self.search({"properties": [{"name": "Color", "value": "bl", "logic": "icontains"}]})
+        self.assertEqual(response.status_code, 503)
+
+    def test_search_engine_unavailable(self):
+        with mock.patch.object(MemorySearchBackend, 'search', side_effect=admission.SearchUnavailable):
+            response = self.search({"search": "element:Pb"})
+        self.assertEqual(response.status_code, 503)
+
+
+class PkSlicesTests(SimpleTestCase):
+    '''
+    Split of the primary key range between the reindex workers
+    '''
+    def test_every_pk_once(self):
+        for pk_min, pk_max, n_slices in ((1, 1, 4), (1, 3, 8), (1, 100, 4), (7, 1000, 16), (1, 10, 3), (5, 6, 1)):
+            with self.subTest(pk_min=pk_min, pk_max=pk_max, n_slices=n_slices):
+                slices = reindex.pk_slices(pk_min, pk_max, n_slices)
+                self.assertLessEqual(len(slices), n_slices)
+                covered = [pk for start, end in slices for pk in range(start, end)]
+                self.assertEqual(covered, list(range(pk_min, pk_max + 1)))
+
+
+class IndexSliceTests(TestCase):
+    '''
+    Indexing of the materials of the pk slices by the reindex workers
+    '''
+    def setUp(self):
+        haystack_connections['default'].get_backend().clear()
+
+    def tearDown(self):
+        haystack_connections['default'].get_backend().clear()
+
+    def index(self, n_slices):
+        '''
+        Index every slice in this process, in batches of 2; return the number of materials indexed
+        '''
+        bounds = [Material.objects.order_by(order).values_list('pk', flat=True).first() for order in ('pk', '-pk')]
+        if bounds[0] is None:
+            return 0
+        # The workers close the database connections they inherit, which would end the test transaction
+        with mock.patch.object(reindex.db_connections, 'close_all'):
+            return sum(reindex.index_slice(('default', 'materials_db', start, end, 2))
+                       for start, end in reindex.pk_slices(bounds[0], bounds[1], n_slices))
+
+    def test_empty_table(self):
+        self.assertEqual(self.index(4), 0)
+        self.assertEqual(MemorySearchBackend.documents, {})
+
+    def test_gaps(self):
+        materials = [Material.objects.create(compound=compound)
+                     for compound in ('Pb1S1', 'Cd1S1', 'Zn1S1', 'Pb1Se1', 'Cd1Se1', 'Zn1Se1', 'Pb1Te1')]
+        for material in materials[1:3] + materials[4:5]:
+            material.delete()
+        pks = {material.pk for material in materials[:1] + materials[3:4] + materials[5:]}
+        for n_slices in (1, 3, 16):
+            with self.subTest(n_slices=n_slices):
+                haystack_connections['default'].get_backend().clear()
+                self.assertEqual(self.index(n_slices), len(pks))
+                self.assertEqual(set(MemorySearchBackend.documents), pks)
+
+
+class BulkRequestTests(SimpleTestCase):
+    '''
+    Requests sent to Elasticsearch by MaterialsSearchBackend
+    '''
+    def setUp(self):
+        self.backend = MaterialsSearchBackend('default', URL='http://localhost:9200', INDEX_NAME='materials_db')
+        self.backend.setup_complete = True
+
+    def test_update_in_one_request(self):
+        materials = [Material(pk=pk, compound='Pb1S1', elements='Pb,S', groups='14,16', periods='3,6', csv='Pb1S1')
+                     for pk in range(1, 1201)]
+        with mock.patch('data.search_backends.bulk') as bulk:
+            self.backend.update(MaterialIndex(), materials, commit=False)
+        self.assertEqual(bulk.call_count, 1)
+        documents = list(bulk.call_args[0][1])
+        self.assertEqual(len(documents), 1200)
+        self.assertEqual(bulk.call_args[1]['chunk_size'], 1200)
+        self.assertEqual(documents[0]['_id'], 'data.material.1')
+
+    def test_remove_many_in_one_request(self):
+        with mock.patch('data.search_backends.bulk') as bulk:
+            self.backend.remove_many(['data.material.{}'.format(pk) for pk in range(1, 1201)], commit=False)
+        self.assertEqual(bulk.call_count, 1)
+        self.assertEqual(bulk.call_args[1]['chunk_size'], 1200)
+        self.assertEqual(len(list(bulk.call_args[0][1])), 1200)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ConditionalSearchTests(TestCase):
+    '''
+    ETags of GET searches, derived from the query and the database generation
+    '''
+    QUERY = {'query': '{"search": "*"}'}
+
+    def setUp(self):
+        Material.objects.create(compound='Pb1S1')
+
+    def test_etag(self):
+        for url in ('/data/search', '/data/facets'):
+            with self.subTest(url=url):
+                response = self.client.get(url, self.QUERY)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['ETag'])
+
+    def test_not_modified(self):
+        etag = self.client.get('/data/search', self.QUERY)['ETag']
+        with mock.patch.object(db, 'query_from_dictionary') as query_from_dictionary:
+            response = self.client.get('/data/search', self.QUERY, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        query_from_dictionary.assert_not_called()
+
+    def test_write_changes_etag(self):
+        etag = self.client.get('/data/search', self.QUERY)['ETag']
+        Material.objects.create(compound='Cd1S1')
+        response = self.client.get('/data/search', self.QUERY, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content.decode())), 2)
+
+    def test_post_without_etag(self):
+        response = self.client.post('/data/search', data=self.QUERY['query'], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(SEARCH_MAX_RESULTS=0)
+    def test_errors_without_etag(self):
+        for query, status in (('{"search": ', 400), (self.QUERY['query'], 413)):
+            with self.subTest(query=query):
+                response = self.client.get('/data/search', {'query': query})
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(response.has_header('ETag'))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class AdminActionTests(TestCase):
+    '''
+    Bulk actions of the materials and properties admins
+    '''
+    def setUp(self):
+        for compound in ('Pb1S1', 'Cd1S1', 'Zn1Se1'):
+            material = Material.objects.create(compound=compound)
+            material.properties.create(propertyName='Band gap', propertyValue='1')
+            material.properties.create(propertyName='Color', propertyValue='black')
+            material.save()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def action(self, model, action, pks, **extra):
+        return self.client.post('/admin/data/{}/'.format(model), {
+            'action': action, 'index': '0', 'post': 'yes', '_selected_action': [str(pk) for pk in pks]}, **extra)
+
+    def test_delete_materials(self):
+        pks = list(Material.objects.exclude(compound='Zn1Se1').values_list('pk', flat=True))
+        generation = Generation.current().value
+        self.assertEqual(self.action('material', 'delete_in_batches', pks).status_code, 302)
+        self.assertEqual(list(Material.objects.values_list('compound', flat=True)), ['Zn1Se1'])
+        self.assertEqual(Property.objects.count(), 2)
+        self.assertEqual(stored_facet_counts(), recount_facets())
+        # One batch: one generation and a single bulk insert into the change log
+        self.assertEqual(Generation.current().value, generation + 1)
+        deleted = Change.objects.filter(action=Change.DELETE)
+        self.assertEqual(sorted(deleted.values_list('model', flat=True)), ['material'] * 2 + ['property'] * 4)
+
+    def test_delete_properties(self):
+        pks = Property.objects.filter(propertyName='Color').values_list('pk', flat=True)
+        self.assertEqual(self.action('property', 'delete_in_batches', pks).status_code, 302)
+        self.assertFalse(Property.objects.filter(propertyName='Color').exists())
+        self.assertEqual(Material.objects.count(), 3)
+        self.assertEqual(stored_facet_counts(), recount_facets())
+
+    def test_export_csv_compressed(self):
+        pks = Material.objects.values_list('pk', flat=True)
+        response = self.action('material', 'export_csv', pks, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        csv = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(csv[0], 'Chemical formula,Property 1 name,Property 1 value')
+        self.assertEqual(sorted(csv[1:]), ['Cd1S1,Band gap,1,Color,black', 'Pb1S1,Band gap,1,Color,black',
+                                           'Zn1Se1,Band gap,1,Color,black'])
+
+
+class CompressionTests(SimpleTestCase):
+    '''
+    Encoding of json responses, and their compression by compress_response
+    '''
+    DATA = [{"compound": "Pb1S1", "properties": [{"propertyName": "Band gap", "propertyValue": "0.41"}]}] * 20
+
+    def get(self, data, **headers):
+        @responses.compress_response
+        @condition(etag_func=lambda request: '"1-abc"')
+        def view(request):
+            return responses.FastJsonResponse(data, safe=False)
+
+        return view(RequestFactory().get('/data/search', **headers))
+
+    def test_json(self):
+        self.assertEqual(json.loads(responses.json_dumps(self.DATA).decode()), self.DATA)
+        self.assertIn(b'\n  ', responses.json_dumps({"a": [1]}, indent=True))
+        with self.assertRaises(TypeError):
+            responses.FastJsonResponse(self.DATA)
+
+    @unittest.skipIf(responses.brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        response = self.get(self.DATA, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(responses.brotli.decompress(response.content).decode()), self.DATA)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def test_gzip(self):
+        response = self.get(self.DATA, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content).decode()), self.DATA)
+
+    def test_identity(self):
+        response = self.get(self.DATA)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content.decode()), self.DATA)
+        self.assertEqual(response['ETag'], '"1-abc"')
+
+    def test_vary(self):
+        for encoding in ('br', 'gzip', ''):
+            with self.subTest(encoding=encoding):
+                response = self.get(self.DATA, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_weak_etag(self):
+        for encoding in ('br', 'gzip'):
+            with self.subTest(encoding=encoding):
+                response = self.get(self.DATA, HTTP_ACCEPT_ENCODING=encoding)
+                self.assertEqual(response['ETag'], 'W/"1-abc"')
+                # The weak ETag still validates the cached response
+                response = self.get(self.DATA, HTTP_ACCEPT_ENCODING=encoding, HTTP_IF_NONE_MATCH='W/"1-abc"')
+                self.assertEqual(response.status_code, 304)
+
+    def test_small_responses_not_compressed(self):
+        for encoding in ('br', 'gzip'):
+            with self.subTest(encoding=encoding):
+                response = self.get([], HTTP_ACCEPT_ENCODING=encoding)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(response.content, b'[]')
+                self.assertEqual(response['ETag'], '"1-abc"')
@@ -0,0 +1,100 @@
+'''
+Parsing of property values with units, such as "3.19 eV", "1.2-1.5", "~300 K" or "5.6e3 kg/m3"
+
+Values are converted to a canonical unit per physical quantity, so that they can be
+compared numerically whatever unit they were entered in. Only the units in the table
+below are recognized: a number followed by any other text is not a numerical value
+(e.g. "2H polytype"). pint (through pyEQL) is not used, since it is slow to import
+and to parse with, and values are parsed on every property save
+'''
+import functools
+import re
+
+# (canonical unit, factor, offset, spellings): canonical value = value * factor + offset
+_UNITS = (
+    # Energy
+    ('eV', 1, 0, ('eV', 'ev')),
+    ('eV', 1e-3, 0, ('meV',)),
+    ('eV', 1e3, 0, ('keV',)),
+    ('eV', 6.241509074e18, 0, ('J',)),
+    # Temperature
+    ('K', 1, 0, ('K', 'kelvin')),
+    ('K', 1, 273.15, ('°C', '℃', 'degC', 'deg C')),
+    ('K', 5 / 9, 273.15 - 32 * 5 / 9, ('°F', '℉', 'degF', 'deg F')),
+    # Density
+    ('kg/m3', 1, 0, ('kg/m3', 'kg/m^3', 'kg/m³', 'kg m-3')),
+    ('kg/m3', 1e3, 0, ('g/cm3', 'g/cm^3', 'g/cm³', 'g/cc', 'g cm-3', 'g/mL', 'g/ml')),
+    # Length
+    ('m', 1, 0, ('m',)),
+    ('m', 1e-2, 0, ('cm',)),
+    ('m', 1e-3, 0, ('mm',)),
+    ('m', 1e-6, 0, ('um', 'µm', 'μm')),
+    ('m', 1e-9, 0, ('nm',)),
+    ('m', 1e-10, 0, ('Å', '\u212b', 'angstrom')),
+    ('m', 1e-12, 0, ('pm',)),
+    # Pressure
+    ('Pa', 1, 0, ('Pa',)),
+    ('Pa', 1e3, 0, ('kPa',)),
+    ('Pa', 1e6, 0, ('MPa',)),
+    ('Pa', 1e9, 0, ('GPa',)),
+    ('Pa', 1e5, 0, ('bar',)),
+    ('Pa', 101325, 0, ('atm',)),
+    # Molar mass
+    ('g/mol', 1, 0, ('g/mol', 'g mol-1')),
+    ('g/mol', 1e3, 0, ('kg/mol',)),
+    # Fractions
+    ('%', 1, 0, ('%',)),
+)
+
+# spelling -> (canonical unit, factor, offset)
+UNITS = {spelling: (canonical, factor, offset)
+         for canonical, factor, offset, spellings in _UNITS for spelling in spellings}
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+# Optional approximation sign, a number, optionally a range (1.2-1.5, 1.2 to 1.5)
+# or an uncertainty (3.19 +/- 0.05), and optionally a unit
+_VALUE = re.compile(
+    r'^(?:~|≈|ca\.|approx\.)?\s*(?P<low>' + _NUMBER + r')'
+    r'(?:\s*(?:(?P<range>-|–|—|to|\.\.)|(?P<error>±|\+/-|\+-))\s*(?P<high>' + _NUMBER + r'))?'
+    r'\s*(?P<unit>.*?)\s*$')
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_value(string):
+    '''
+    Numerical value of a property, in canonical units
+
+    The same values occur many times in the database (and in uploaded files),
+    so the results are cached
+
+    Parameters
+    ----------
+    string : string, required
+                Property value, e.g. "3.19 eV", "1.2-1.5", "~300 K" or "5.6e3 kg/m3"
+
+    Returns
+    -------
+    (float, string, float, float)
+            Magnitude (the middle of a range), canonical unit ('' for numbers
+            without units), lower and upper bounds of the value
+    None
+            If the string is not a number with an optional known unit
+    '''
+    match = _VALUE.match(str(string).strip())
+    if match is None:
+        return None
+    unit = match.group('unit')
+    if unit not in UNITS and unit != '':
+        return None
+    canonical, factor, offset = UNITS.get(unit, ('', 1, 0))
+    low = float(match.group('low'))
+    if match.group('range'):
+        high = float(match.group('high'))
+        low, high = min(low, high), max(low, high)
+    elif match.group('error'):
+        error = abs(float(match.group('high')))
+        low, high = low - error, low + error
+    else:
+        high = low
+    low, high = low * factor + offset, high * factor + offset
+    return (low + high) / 2, canonical, low, high
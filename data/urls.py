@@ -5,5 +5,7 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('add', views.add, name='add'),
-    path('search', views.search, name='search')
+    path('search', views.search, name='search'),
+    path('facets', views.facets, name='facets'),
+    path('changes', views.changes, name='changes')
 ]
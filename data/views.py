@@ -1,13 +1,22 @@
+from django.conf import settings
+from django.db import OperationalError
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from functools import wraps
 import requests
 
-from data.models import Material
+from data.models import Material, Generation, Change, batch_writes
 from data.forms import JSONForm, DataUploadForm
+from data.responses import FastJsonResponse, compress_response
+from data.routers import read_from_replica, pin_primary
+import data.admission as admission
 import data.db as db
 
 
+@compress_response
 def index(request):
     '''
     Web interface to the materials database API
@@ -51,15 +60,16 @@ def index(request):
             query = form.cleaned_data['entry']
             hostname = request.get_host()
             url = request.scheme + '://' + hostname + reverse(query_type)
-            response = requests.post(url, data=query)
+            # Pass the client's cookies on, so that its searches see its own additions
+            response = requests.post(url, data=query, cookies=request.COOKIES)
             # Check if the response was successful, then serve
             # the main page again or display the search results
             if not response.ok:
                 return render_index(response.json()['error'])
             if query_type == 'add':
-                return render_index('Materials added successfully.'.format(query))
+                return pin_primary(render_index('Materials added successfully.'.format(query)))
             elif query_type == 'search':
-                return JsonResponse(response.json(), json_dumps_params={'indent': 2}, safe=False)
+                return FastJsonResponse(response.json(), indent=True, safe=False)
 
         # Handle file uploads
         elif query_type == 'upload':
@@ -98,19 +108,21 @@ def add(request):
         if isinstance(query_dictionary, str):
             return JsonResponse({"error": query_dictionary}, status=400)
 
-        for alloy in query_dictionary:  # query_dictionary is a list of materials
-            # Initialize a material
-            material = Material(compound=alloy["compound"])
-            material_saved = db.save_to_db(material)
-            if not material_saved:
-                return JsonResponse({"error": "Chemical formula \"{}\" is incorrect (must follow pyEQL syntax)".format(alloy["compound"])}, status=400)
-            [material.properties.create(
-                propertyName=compound_property["propertyName"], propertyValue=compound_property["propertyValue"])
-                for compound_property in alloy["properties"]]
-            # Save the material again to update the csv field, needed for search indexing
-            material_saved = db.save_to_db(material)
-            if not material_saved:
-                return JsonResponse({"error": "Chemical formula \"{}\" is incorrect (must follow pyEQL syntax)".format(alloy["compound"])}, status=400)
+        # The materials are added in one transaction; the change log and the facet counts are written at its end
+        with batch_writes():
+            for alloy in query_dictionary:  # query_dictionary is a list of materials
+                # Initialize a material
+                material = Material(compound=alloy["compound"])
+                material_saved = db.save_to_db(material)
+                if not material_saved:
+                    return JsonResponse({"error": "Chemical formula \"{}\" is incorrect (must follow pyEQL syntax)".format(alloy["compound"])}, status=400)
+                [material.properties.create(
+                    propertyName=compound_property["propertyName"], propertyValue=compound_property["propertyValue"])
+                    for compound_property in alloy["properties"]]
+                # Save the material again to update the csv field, needed for search indexing
+                material_saved = db.save_to_db(material)
+                if not material_saved:
+                    return JsonResponse({"error": "Chemical formula \"{}\" is incorrect (must follow pyEQL syntax)".format(alloy["compound"])}, status=400)
 
         # If success, return just added materials as a json
         return JsonResponse(query_dictionary, safe=False)
@@ -118,10 +130,127 @@ def add(request):
         return JsonResponse({"error": "Only POST method supported"}, status=405)
 
 
+def search_query(request):
+    '''
+    Search query dictionary of the request, taken from the request body (POST)
+    or from the query parameter (GET); it is parsed once and stored on the request
+
+    Returns
+    -------
+    dict
+            Search query dictionary
+    string
+            Error message, if the json is incorrect
+    '''
+    if not hasattr(request, 'search_query'):
+        if request.method == 'POST':
+            body = request.body
+        else:
+            # Facets of the whole database are requested without a query
+            body = request.GET.get('query', '{}' if request.resolver_match.url_name == 'facets' else '')
+        request.search_query = db.json_to_dictionary(body, request_type='search')
+    return request.search_query
+
+
+def search_generation(request):
+    '''
+    Database generation, read once per request
+    '''
+    if not hasattr(request, 'search_generation'):
+        request.search_generation = Generation.current()
+    return request.search_generation
+
+
+def search_etag(request):
+    '''
+    ETag of the GET search request, derived from the query and the database generation
+    '''
+    if request.method not in ('GET', 'HEAD') or isinstance(search_query(request), str):
+        return None
+    return db.search_etag(search_query(request), search_generation(request).value)
+
+
+def search_condition(view):
+    '''
+    View decorator: condition(etag_func=search_etag), answering conditional GET requests
+    with 304 Not Modified, with the ETag removed from error responses, so that an error
+    is never revalidated by a client or a cache
+    '''
+    conditional_view = condition(etag_func=search_etag)(view)
+
+    @wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        if response.status_code not in (200, 304) and response.has_header('ETag'):
+            del response['ETag']
+        return response
+    return wrapped_view
+
+
+def run_search(query_dictionary, evaluate):
+    '''
+    Run a search under admission control: searches that are too expensive (413) or that
+    match too many materials (413) are rejected, heavy ones are rejected (429) unless one
+    of the slots for heavy searches is free, and all are stopped after SEARCH_TIMEOUT seconds (503)
+
+    Parameters
+    ----------
+    query_dictionary : dict, required
+                        Search query represented by a dictionary, obtained from user's json
+    evaluate : function, required
+                        Function making the response from the QuerySet of matching materials
+
+    Returns
+    -------
+    JsonResponse
+                Response returned by evaluate, or error message if something went wrong
+    '''
+    # Reject searches that are too expensive, and keep heavy ones
+    # from taking all the workers, before doing any work
+    cost = admission.search_cost(query_dictionary)
+    if cost > settings.SEARCH_MAX_COST:
+        return JsonResponse({"error": "The search is too expensive (cost {} of {})".format(cost, settings.SEARCH_MAX_COST),
+                             "hint": "Add a full-text search or replace contains filters by exact or numerical ones"},
+                            status=413)
+    with admission.search_slot(cost) as admitted:
+        if not admitted:
+            response = JsonResponse({"error": "Too many expensive searches are running",
+                                     "hint": "Retry later, or narrow down the search to make it cheaper"},
+                                    status=429)
+            response['Retry-After'] = '1'
+            return response
+
+        # If everything went well, compile the search query and evaluate it
+        try:
+            with admission.statement_timeout(settings.SEARCH_TIMEOUT):
+                query = db.query_from_dictionary(query_dictionary, max_results=settings.SEARCH_MAX_RESULTS)
+                if isinstance(query, str):
+                    return JsonResponse({"error": query}, status=400)
+                return evaluate(query)
+        except admission.TooManyResults:
+            return JsonResponse({"error": "The search matches more than {} materials".format(settings.SEARCH_MAX_RESULTS),
+                                 "hint": "Narrow down the search"},
+                                status=413)
+        except (admission.SearchUnavailable, OperationalError):
+            return JsonResponse({"error": "The search took too long or the search engine is unavailable",
+                                 "hint": "Narrow down the search, or retry later"},
+                                status=503)
+
+
+@compress_response
+@read_from_replica
+@search_condition
 def search(request):
     '''
     API for searching material in the database
 
+    The query json is sent either as the body of a POST request, or as the url-encoded
+    query parameter of a GET request: /data/search?query={"search":"PbS"}
+    GET responses carry an ETag header, which changes whenever the database does,
+    and conditional GET requests are answered with 304 Not Modified without running
+    the search (there is no Last-Modified header: with its one second resolution,
+    a change made in the same second as the response would go unnoticed)
+
     Parameters
     ----------
     request : Http request
@@ -132,22 +261,112 @@ def search(request):
     JsonResponse
                 Search result or error message if something went wrong
     '''
-    if request.method == 'POST':
+    if request.method in ('GET', 'HEAD', 'POST'):
         # Load request body, check it & make sure it conforms to schema
-        query_dictionary = db.json_to_dictionary(request.body, request_type='search')
+        query_dictionary = search_query(request)
         # If the result of the last operation is a string rather than dict
         # (error message), send a JsonResoponse containing this string
         if isinstance(query_dictionary, str):
             return JsonResponse({"error": query_dictionary}, status=400)
 
-        # If everything went well, serialize the json, compile the search query,
-        # and make the list of materials matching the request
-        query = db.query_from_dictionary(query_dictionary)
-        if isinstance(query, str):
-            return JsonResponse({"error": query}, status=400)
+        def search_result(query):
+            '''
+            Serialize the materials matching the query
+            '''
+            return FastJsonResponse(db.query_to_dictionary(query.all()), safe=False)
 
-        search_result = db.query_to_dictionary(query)
-        # Output the list of materials as a Json
-        return JsonResponse(search_result, safe=False)
+        response = run_search(query_dictionary, search_result)
+        if response.status_code == 200 and request.method != 'POST':
+            # Let reverse proxies store the result; they revalidate it with the ETag
+            patch_cache_control(response, public=True, max_age=settings.SEARCH_CACHE_MAX_AGE)
+        return response
     else:
-        return JsonResponse({"error": "Only POST method supported"}, status=405)
+        return JsonResponse({"error": "Only GET and POST methods supported"}, status=405)
+
+
+@compress_response
+@read_from_replica
+@search_condition
+def facets(request):
+    '''
+    API for counting the materials matching a search, per element, group, period,
+    and the properties of these materials per property name
+
+    The query json is the same as for /data/search, and is sent the same way;
+    GET requests without a query count all the materials in the database:
+    {"total": 103, "element": {"O": 40, "Pb": 12, ...}, "group": {...}, "period": {...}, "property": {...}}
+
+    Parameters
+    ----------
+    request : Http request
+                Request containing json for querying the database
+
+    Returns
+    -------
+    JsonResponse
+                Facet counts or error message if something went wrong
+    '''
+    if request.method in ('GET', 'HEAD', 'POST'):
+        query_dictionary = search_query(request)
+        if isinstance(query_dictionary, str):
+            return JsonResponse({"error": query_dictionary}, status=400)
+
+        if admission.matches_all(query_dictionary) and not query_dictionary.get("properties"):
+            # No filters (or a search matching everything): read the counts kept up to date for the whole database
+            response = FastJsonResponse(db.facet_counts())
+        else:
+            def count_facets(query):
+                '''
+                Count the facets of the materials matching the query, in the database
+                '''
+                return FastJsonResponse(db.facet_counts(query))
+
+            # Searches matching more than SEARCH_MAX_RESULTS materials are rejected by run_search
+            response = run_search(query_dictionary, count_facets)
+        if response.status_code == 200 and request.method != 'POST':
+            patch_cache_control(response, public=True, max_age=settings.SEARCH_CACHE_MAX_AGE)
+        return response
+    else:
+        return JsonResponse({"error": "Only GET and POST methods supported"}, status=405)
+
+
+@compress_response
+@read_from_replica
+def changes(request):
+    '''
+    API for synchronizing a copy of the database incrementally: the changes of materials
+    and properties logged after a given sequence number, in pages of at most CHANGES_PAGE_SIZE
+
+    /data/changes?since=0 returns the first page of the log; the next page is requested
+    with since set to the "next" sequence number of the response, while "more" is true:
+    {"changes": [{"seq": 1, "model": "material", "id": 1, "action": "create", "time": ..., "data": {...}}, ...],
+     "next": 1000, "more": true}
+
+    Parameters
+    ----------
+    request : Http request
+                GET request with the since and (optional) limit parameters
+
+    Returns
+    -------
+    JsonResponse
+                Page of changes or error message if something went wrong
+    '''
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({"error": "Only GET method supported"}, status=405)
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = int(request.GET.get('limit', settings.CHANGES_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({"error": "since and limit must be integers"}, status=400)
+    if since < 0 or not 0 < limit <= settings.CHANGES_PAGE_SIZE:
+        return JsonResponse({"error": "since must be non-negative, and limit between 1 and {}".format(settings.CHANGES_PAGE_SIZE)},
+                            status=400)
+
+    # A range scan of the primary key index: the cost depends on the page, not on the database
+    page = list(Change.objects.filter(seq__gt=since).order_by('seq')[:limit + 1])
+    more = len(page) > limit
+    page = page[:limit]
+    return FastJsonResponse({"changes": [change.to_dict() for change in page],
+                             "next": page[-1].seq if page else since,
+                             "more": more})
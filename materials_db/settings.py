@@ -51,6 +51,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'data.routers.PrimaryPinningMiddleware',
+    'data.recorder.TrafficRecorderMiddleware',
 ]
 
 ROOT_URLCONF = 'materials_db.urls'
@@ -82,7 +84,7 @@ port = es.port or 80
 HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
 HAYSTACK_CONNECTIONS = {
     'default': {
-        'ENGINE': 'haystack.backends.elasticsearch2_backend.Elasticsearch2SearchEngine',
+        'ENGINE': 'data.search_backends.MaterialsSearchEngine',
         'URL': es.scheme + '://' + es.hostname + ':' + str(port),
         'INDEX_NAME': 'materials_db',
     },
@@ -91,6 +93,28 @@ HAYSTACK_CONNECTIONS = {
 if es.username:
     HAYSTACK_CONNECTIONS['default']['KWARGS'] = {"http_auth": es.username + ':' + es.password}
 
+# Seconds for which caches may serve GET search results without revalidating them
+# (revalidation is cheap: unchanged results are answered with 304 Not Modified)
+SEARCH_CACHE_MAX_AGE = 0
+
+# Admission control of searches (data/admission.py): searches estimated to cost
+# more than SEARCH_MAX_COST, or matching more than SEARCH_MAX_RESULTS materials,
+# are rejected; at most SEARCH_HEAVY_SLOTS searches costing SEARCH_HEAVY_COST or more
+# run at the same time (in all the worker processes, on PostgreSQL), others are rejected
+SEARCH_MAX_COST = 20
+SEARCH_HEAVY_COST = 10
+SEARCH_HEAVY_SLOTS = 2
+SEARCH_MAX_RESULTS = 10000
+# Seconds after which Elasticsearch and database statements of a search are aborted
+SEARCH_TIMEOUT = 10
+
+# Largest number of changes returned by one /data/changes request
+CHANGES_PAGE_SIZE = 1000
+
+# Append /data/add, /data/search and /data/facets requests to this json lines file, to replay them
+# with benchmarks.loadtest (recording is off unless the environment variable is set)
+TRAFFIC_RECORD_PATH = os.environ.get('TRAFFIC_RECORD_PATH')
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -131,3 +155,18 @@ STATIC_URL = '/static/'
 
 django_heroku.settings(locals())
 DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=True)
+
+# Read replicas, given as comma-separated database urls in REPLICA_DATABASE_URLS;
+# search queries are sent to them by data.routers.ReplicaRouter
+DATABASE_REPLICAS = []
+for n, url in enumerate(filter(None, os.environ.get('REPLICA_DATABASE_URLS', '').split(','))):
+    alias = 'replica{}'.format(n + 1)
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, ssl_require=url.startswith('postgres'))
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['data.routers.ReplicaRouter']
+# Seconds during which a client reads from the primary database after writing to it
+REPLICA_PIN_SECONDS = 10
+# Seconds before a replica that could not be connected to is tried again
+REPLICA_RETRY_SECONDS = 30
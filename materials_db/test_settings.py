@@ -0,0 +1,29 @@
+'''
+Settings for the tests: the application settings with sqlite3 databases and the
+in-memory search backend of the benchmarks, so that the tests run without
+PostgreSQL and Elasticsearch
+
+$ python manage.py test data --settings=materials_db.test_settings
+
+Two read replicas mirror the primary database, as replicas of a real deployment would
+'''
+from materials_db.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+}
+DATABASE_REPLICAS = ['replica1', 'replica2']
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+
+HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
+HAYSTACK_CONNECTIONS = {
+    'default': {
+        'ENGINE': 'benchmarks.search_backend.MemoryEngine',
+    },
+}
+
+TRAFFIC_RECORD_PATH = None